@@ -28,7 +28,7 @@ status_json = response.json()
 
 
 def parse_number_of_certificates(xml_file):
-    root = ET.fromstring(xml_file)
+    root = xml_file if ET.iselement(xml_file) else ET.fromstring(xml_file)
     number_of_certificates = root.find(".//NumberOfCertificates")
 
     if number_of_certificates is not None:
@@ -39,7 +39,7 @@ def parse_number_of_certificates(xml_file):
 
 
 def parse_certificates(xml_file, pem_number):
-    root = ET.fromstring(xml_file)
+    root = xml_file if ET.iselement(xml_file) else ET.fromstring(xml_file)
 
     pem_certificates = root.findall('.//Certificate[@format="pem"]')
 
@@ -69,8 +69,9 @@ def compare_keys(public_key1, public_key2):
 def keybox_check(certificate_text):
     try:
         # Assuming the certificate text contains PEM certificates
-        pem_number = parse_number_of_certificates(certificate_text)
-        pem_certificates = parse_certificates(certificate_text, pem_number)
+        root = ET.fromstring(certificate_text)
+        pem_number = parse_number_of_certificates(root)
+        pem_certificates = parse_certificates(root, pem_number)
     except Exception as e:
         print(f"[Keybox Check Error]: {e}")
         return False
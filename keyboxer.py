@@ -5,19 +5,34 @@ import zipfile
 import gzip
 import io
 import tarfile
+import tempfile
 import time
 import random
 import json
+import re
 import sys
-from urllib.parse import urljoin, urlparse, parse_qs
-from bs4 import BeautifulSoup
+import argparse
+import multiprocessing
+import sqlite3
+import threading
+from urllib.parse import urljoin, urlparse, quote, unquote_plus
 import logging
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from bisect import bisect_left
 
-from lxml import etree
+from lxml import etree, html as lhtml
+from urllib3.util.retry import Retry
 from pathlib import Path
 from dotenv import load_dotenv
 
+# orjson is optional; it is faster than json for the rate limit state
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Set up more robust error handling for imports
 try:
     from check import keybox_check as CheckValid
@@ -76,48 +91,318 @@ USER_AGENTS = [
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 ]
 
-# Set up session
+# Number of candidate URLs downloaded concurrently
+URL_WORKERS = 8
+
+# Set up session; keep enough pooled keep-alive connections per host for
+# every download worker so TLS handshakes are paid once, not per request.
+# Transient gateway errors are retried with backoff inside the adapter; once
+# retries run out the last response is returned as before.
 session = requests.Session()
+http_retry = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[502, 503, 504],
+    allowed_methods=["GET", "HEAD"],
+    raise_on_status=False
+)
+http_adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=URL_WORKERS * 2, max_retries=http_retry)
+session.mount("https://", http_adapter)
+session.mount("http://", http_adapter)
 session.headers.update({
     "User-Agent": random.choice(USER_AGENTS),
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
     "Accept-Language": "en-US,en;q=0.5"
 })
 
+# Attaches the GitHub token per request, and only to GitHub hosts, so it is
+# never sent to search engines or to arbitrary hosts found in results
+class GitHubTokenAuth(requests.auth.AuthBase):
+    HOSTS = ("api.github.com", "raw.githubusercontent.com")
+    
+    def __init__(self, token):
+        self.token = token
+    
+    def __call__(self, request):
+        if urlparse(request.url).hostname in self.HOSTS:
+            request.headers["Authorization"] = f"token {self.token}"
+        return request
+
 if GITHUB_TOKEN:
-    session.headers.update({"Authorization": f"token {GITHUB_TOKEN}"})
+    session.auth = GitHubTokenAuth(GITHUB_TOKEN)
 
 # Use only the original search term
 SEARCH_TERM = "<AndroidAttestation>"
 
+# Keyboxes are small and open with this tag, so payloads that lack it in
+# their first KEYBOX_SNIFF_SIZE bytes are rejected without being parsed
+KEYBOX_SENTINEL = SEARCH_TERM.encode()
+KEYBOX_SNIFF_SIZE = 64 * 1024
+
+# An XML declaration must open the document, optionally after a UTF-8 BOM;
+# keyboxes saved without one open directly with the search term
+XML_HEADS = (b'<?xml', b'\xef\xbb\xbf<?xml', KEYBOX_SENTINEL)
+
 # Supported file extensions
-SUPPORTED_EXTENSIONS = ['.xml', '.zip', '.gz', '.tar', '.tgz', '.tar.gz']
+# A tuple, so names can be tested with a single str.endswith() call
+SUPPORTED_EXTENSIONS = ('.xml', '.zip', '.gz', '.tar', '.tgz', '.tar.gz')
+
+# Matches a URL whose path (everything before the first ? or #) ends in one of
+# SUPPORTED_EXTENSIONS; ".tar.gz" is covered by ".gz"
+SUPPORTED_EXTENSION_RE = re.compile(r'^[^?#]*\.(?:xml|zip|gz|tar|tgz)(?:[?#]|$)', re.IGNORECASE)
+
+# GitHub code search query and URL. All extensions are OR-ed into one query
+# so the search costs one API call per page instead of one per extension.
+# GitHub matches only the last extension, so ".tar.gz" is covered by "gz".
+GITHUB_SEARCH_EXTENSIONS = ['xml', 'zip', 'gz', 'tar', 'tgz']
+GITHUB_CODE_QUERY = SEARCH_TERM + " " + " OR ".join(f"extension:{ext}" for ext in GITHUB_SEARCH_EXTENSIONS)
+GITHUB_CODE_SEARCH_URL = f"https://api.github.com/search/code?q={quote(GITHUB_CODE_QUERY)}"
+
+# GitHub returns at most this many results for any one search
+GITHUB_SEARCH_MAX_RESULTS = 1000
+
+# Web search engines. "query" is formatted per extension and "params" per
+# results page; both are expanded once here into engine["queries"].
+MAX_SEARCH_PAGES = 2  # Reduced from 3 to 2 to respect rate limits
+SEARCH_ENGINES = [
+    {
+        "name": "Google",
+        "id": "google",
+        "url": "https://www.google.com/search",
+        "query": "{term} filetype:{ext}",
+        "params": lambda q, page: {"q": q, "num": 100, "start": (page - 1) * 100},
+        "extractor": "google"
+    },
+    {
+        "name": "Bing",
+        "id": "bing",
+        "url": "https://www.bing.com/search",
+        "query": "{term} filetype:{ext}",
+        "params": lambda q, page: {"q": q, "count": 50, "first": (page - 1) * 50},
+        "extractor": "bing"
+    },
+    {
+        "name": "DuckDuckGo",
+        "id": "duckduckgo",
+        "url": "https://duckduckgo.com/html/",
+        "query": "{term} {ext}",
+        "params": lambda q, page: {"q": q, "s": (page - 1) * 30},
+        "extractor": "duckduckgo"
+    },
+    {
+        "name": "Ecosia",
+        "id": "ecosia",
+        "url": "https://www.ecosia.org/search",
+        "query": "{term} .{ext}",
+        "params": lambda q, page: {"q": q, "p": page - 1},
+        "extractor": "ecosia"
+    }
+]
+for engine in SEARCH_ENGINES:
+    engine["queries"] = []
+    for ext in SUPPORTED_EXTENSIONS:
+        query = engine["query"].format(term=SEARCH_TERM, ext=ext[1:])
+        pages = [engine["params"](query, page) for page in range(1, MAX_SEARCH_PAGES + 1)]
+        engine["queries"].append((query, pages))
 
 # File paths
 save = Path(__file__).resolve().parent / "keys"
 cache_file = Path(__file__).resolve().parent / "cache.txt"
 rate_limit_file = Path(__file__).resolve().parent / "rate_limits.json"
+invalid_report_file = Path(__file__).resolve().parent / "invalid_keyboxes.json"
+validity_db = Path(__file__).resolve().parent / "validity.db"
+
+# Cached validity results are trusted for this long; after that the keybox is
+# re-checked, since certificates expire and get revoked
+VALIDITY_TTL = 24 * 60 * 60
 
 # Ensure the keys directory exists
 save.mkdir(exist_ok=True)
 logger.info(f"Keys directory: {save.absolute()}")
 
-# Load cache
+# Keep the keys directory open so new keyboxes are created relative to it
+# instead of resolving the full path on every write (POSIX only)
+if os.open in os.supports_dir_fd:
+    save_dir_fd = os.open(save, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+else:
+    save_dir_fd = None
+
+# Function to create a new keybox file; raises FileExistsError if a keybox
+# with the same name already exists, so the check and the create are atomic
+def write_new_keybox(file_name, content):
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    if save_dir_fd is not None:
+        fd = os.open(file_name, flags, 0o644, dir_fd=save_dir_fd)
+    else:
+        fd = os.open(save / file_name, flags, 0o644)
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+
+# Candidate downloads run concurrently on this pool; cache_lock guards
+# cached_urls against workers claiming the same URL twice
+url_executor = ThreadPoolExecutor(max_workers=URL_WORKERS, thread_name_prefix="fetch")
+cache_lock = threading.Lock()
+
+# At most HOST_CONCURRENCY downloads run against any one host at a time, so
+# the pool stays polite to a host even when most queued URLs point at it
+HOST_CONCURRENCY = 4
+host_slots = {}
+
+# Function to get the download slot semaphore of a URL's host
+def host_slot(url):
+    host = urlparse(url).netloc
+    slot = host_slots.get(host)
+    if slot is None:
+        slot = host_slots.setdefault(host, threading.BoundedSemaphore(HOST_CONCURRENCY))
+    return slot
+
+# Separate pool for inflating archive members, which runs inside fetch workers
+ARCHIVE_WORKERS = os.cpu_count() or 4
+archive_executor = ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS, thread_name_prefix="inflate")
+
+# Thread-safe token bucket: acquire() blocks until a request may be sent.
+# Callers that find the bucket empty reserve a token and sleep outside the lock.
+class TokenBucket:
+    def __init__(self, rate, period, burst=1):
+        self.fill_rate = rate / period
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+            self.updated = now
+            self.tokens -= 1
+            wait_seconds = -self.tokens / self.fill_rate if self.tokens < 0 else 0
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+# Request pacing per host (requests, seconds); replaces fixed sleeps so each
+# host is paced independently and nothing waits longer than it has to
+HOST_LIMITERS = {
+    "www.google.com": TokenBucket(10, 60),
+    "www.bing.com": TokenBucket(10, 60),
+    "duckduckgo.com": TokenBucket(20, 60),
+    "www.ecosia.org": TokenBucket(10, 60),
+    "api.github.com": TokenBucket(30, 60),
+    "raw.githubusercontent.com": TokenBucket(10, 1, burst=URL_WORKERS),
+}
+
+# Function to wait for the rate limiter of a URL's host, if it has one
+def throttle(url):
+    limiter = HOST_LIMITERS.get(urlparse(url).hostname)
+    if limiter:
+        limiter.acquire()
+
+# Function to compute the 8-byte cache key of a URL. The cache keeps only
+# these keys, in memory and on disk, instead of the full URL strings.
+def url_key(url):
+    return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), "big")
+
+# Function to parse one cache line; older caches stored the full URL
+def parse_cache_line(line):
+    line = line.strip()
+    if len(line) == 16:
+        try:
+            return int(line, 16)
+        except ValueError:
+            pass
+    return url_key(line)
+
+# Set of URL keys built for large caches. Keys loaded from disk are packed
+# into a sorted array of unsigned 64-bit ints (8 bytes each, searched with
+# bisect); only keys added during this run live in a regular set.
+class UrlKeySet:
+    def __init__(self, keys=()):
+        self.loaded = array('Q', sorted(set(keys)))
+        self.added = set()
+    
+    def __contains__(self, key):
+        if key in self.added:
+            return True
+        i = bisect_left(self.loaded, key)
+        return i < len(self.loaded) and self.loaded[i] == key
+    
+    def add(self, key):
+        if key not in self:
+            self.added.add(key)
+    
+    def __len__(self):
+        return len(self.loaded) + len(self.added)
+    
+    def __iter__(self):
+        yield from self.loaded
+        yield from self.added
+
+# Load cache. The file is rewritten at exit only if it holds duplicate or
+# old full-URL lines; otherwise appends keep it compact on their own.
+cache_needs_compaction = False
 try:
-    cached_urls = set(open(cache_file, "r").readlines())
+    with open(cache_file, "r") as f:
+        cache_lines = [line.strip() for line in f if line.strip()]
+    cached_urls = UrlKeySet(parse_cache_line(line) for line in cache_lines)
+    cache_needs_compaction = len(cached_urls) < len(cache_lines) or any(len(line) != 16 for line in cache_lines)
+    del cache_lines
     logger.info(f"Loaded {len(cached_urls)} cached URLs")
 except FileNotFoundError:
     logger.warning(f"Cache file not found: {cache_file}. Creating new one.")
-    cached_urls = set()
-    # Create empty cache file
-    with open(cache_file, "w") as f:
-        pass
+    cached_urls = UrlKeySet()
+
+# New keys are appended as they are claimed, so progress survives a crash and
+# the cache never has to be rewritten in full
+cache_handle = open(cache_file, "a")
+
+# Function to record a URL key in the cache; call with cache_lock held
+def cache_add(key):
+    cached_urls.add(key)
+    cache_handle.write(f"{key:016x}\n")
+    cache_handle.flush()
+
+# Function to rewrite the cache as one sorted key per line. Written in a
+# single buffered pass to a temp file and swapped in, so a crash mid-write
+# leaves the old cache intact.
+def compact_cache():
+    global cache_handle
+    with cache_lock:
+        cache_handle.close()
+        tmp_file = cache_file.with_suffix(".txt.tmp")
+        with open(tmp_file, "w", buffering=1 << 20) as f:
+            f.writelines(f"{key:016x}\n" for key in sorted(cached_urls))
+        os.replace(tmp_file, cache_file)
+        cache_handle = open(cache_file, "a")
+
+# Rate limits are flushed to disk every RATE_LIMIT_FLUSH_EVERY checks and at exit
+RATE_LIMIT_FLUSH_EVERY = 64
+rate_limit_checks = 0
+# Reentrant so check_rate_limit can flush through save_rate_limits while holding it
+rate_limit_lock = threading.RLock()
+rate_limits_dirty = False
+
+# Function to save rate limits if they changed since the last save; written
+# to a temp file and swapped in so an interrupted write never leaves a
+# truncated rate_limits.json behind
+def save_rate_limits():
+    global rate_limits_dirty
+    tmp_file = rate_limit_file.with_suffix(".json.tmp")
+    # Engines are searched concurrently and may flush at the same time
+    with rate_limit_lock:
+        if not rate_limits_dirty:
+            return
+        rate_limits_dirty = False
+        if orjson:
+            tmp_file.write_bytes(orjson.dumps(rate_limits))
+        else:
+            tmp_file.write_text(json.dumps(rate_limits))
+        os.replace(tmp_file, rate_limit_file)
 
 # Load rate limits
 try:
-    with open(rate_limit_file, "r") as f:
-        rate_limits = json.load(f)
-        logger.info(f"Loaded rate limits from file")
+    rate_limit_data = rate_limit_file.read_bytes()
+    rate_limits = orjson.loads(rate_limit_data) if orjson else json.loads(rate_limit_data)
+    logger.info(f"Loaded rate limits from file")
 except FileNotFoundError:
     logger.warning(f"Rate limit file not found: {rate_limit_file}. Creating default.")
     rate_limits = {
@@ -128,46 +413,51 @@ except FileNotFoundError:
         "ecosia": {"reset_time": None, "remaining": 5}
     }
     # Create rate limit file
-    with open(rate_limit_file, "w") as f:
-        json.dump(rate_limits, f)
+    rate_limits_dirty = True
+    save_rate_limits()
 # Function to check and update rate limits
 def check_rate_limit(source):
-    global rate_limits
+    global rate_limits, rate_limit_checks, rate_limits_dirty
     
-    now = datetime.now().isoformat()
-    
-    if rate_limits[source]["reset_time"] is None or now > rate_limits[source]["reset_time"]:
-        if source == "github":
-            rate_limits[source]["reset_time"] = (datetime.now() + timedelta(hours=1)).isoformat()
-            rate_limits[source]["remaining"] = 30
-        elif source == "duckduckgo":
-            rate_limits[source]["reset_time"] = (datetime.now() + timedelta(minutes=15)).isoformat()
-            rate_limits[source]["remaining"] = 20  # Reset to 20 for DuckDuckGo
-        else:
-            rate_limits[source]["reset_time"] = (datetime.now() + timedelta(minutes=15)).isoformat()
-            rate_limits[source]["remaining"] = 5
-    
-    if rate_limits[source]["remaining"] <= 0:
-        reset_time = datetime.fromisoformat(rate_limits[source]["reset_time"])
-        wait_seconds = (reset_time - datetime.now()).total_seconds()
-        if wait_seconds > 0:
-            logger.info(f"Rate limit reached for {source}. Waiting {wait_seconds:.0f} seconds until reset.")
-            return False
-        else:
+    # Engines are searched concurrently; the whole read-modify-write of the
+    # counters and the periodic flush happen under one lock
+    with rate_limit_lock:
+        now = datetime.now().isoformat()
+        
+        if rate_limits[source]["reset_time"] is None or now > rate_limits[source]["reset_time"]:
             if source == "github":
+                rate_limits[source]["reset_time"] = (datetime.now() + timedelta(hours=1)).isoformat()
                 rate_limits[source]["remaining"] = 30
             elif source == "duckduckgo":
-                rate_limits[source]["remaining"] = 20
+                rate_limits[source]["reset_time"] = (datetime.now() + timedelta(minutes=15)).isoformat()
+                rate_limits[source]["remaining"] = 20  # Reset to 20 for DuckDuckGo
             else:
+                rate_limits[source]["reset_time"] = (datetime.now() + timedelta(minutes=15)).isoformat()
                 rate_limits[source]["remaining"] = 5
-            rate_limits[source]["reset_time"] = (datetime.now() + timedelta(minutes=15 if source != "github" else 60)).isoformat()
-    
-    rate_limits[source]["remaining"] -= 1
-    
-    with open(rate_limit_file, "w") as f:
-        json.dump(rate_limits, f)
-    
-    return True
+        
+        if rate_limits[source]["remaining"] <= 0:
+            reset_time = datetime.fromisoformat(rate_limits[source]["reset_time"])
+            wait_seconds = (reset_time - datetime.now()).total_seconds()
+            if wait_seconds > 0:
+                logger.info(f"Rate limit reached for {source}. Waiting {wait_seconds:.0f} seconds until reset.")
+                return False
+            else:
+                if source == "github":
+                    rate_limits[source]["remaining"] = 30
+                elif source == "duckduckgo":
+                    rate_limits[source]["remaining"] = 20
+                else:
+                    rate_limits[source]["remaining"] = 5
+                rate_limits[source]["reset_time"] = (datetime.now() + timedelta(minutes=15 if source != "github" else 60)).isoformat()
+        
+        rate_limits[source]["remaining"] -= 1
+        rate_limits_dirty = True
+        
+        rate_limit_checks += 1
+        if rate_limit_checks % RATE_LIMIT_FLUSH_EVERY == 0:
+            save_rate_limits()
+        
+        return True
 
 # Improved check_github_rate_limit function with built-in waiting option
 def check_github_rate_limit(wait_if_low=False, min_required=10):
@@ -259,63 +549,240 @@ def discover_repositories(keywords=None, max_repos=10):  # Reduced to 10
     
     logger.info(f"Discovered {len(discovered_repos)} repositories")
     return discovered_repos
+# Content types keyed by the magic number that opens the content; tar is
+# recognised by its "ustar" marker at offset 257 instead
+CONTENT_MAGIC = {
+    b'PK\x03\x04': 'zip',
+    b'\x1f\x8b': 'gzip',
+}
+
+# Function to identify downloaded content from its first bytes. Returns
+# 'zip', 'gzip', 'tar', 'xml' or None.
+def sniff_content(content):
+    # One view over the first tar block; slicing it copies nothing
+    head = memoryview(content)[:512]
+    content_type = CONTENT_MAGIC.get(head[:4].tobytes()) or CONTENT_MAGIC.get(head[:2].tobytes())
+    if content_type:
+        return content_type
+    if head[257:262] == b'ustar':
+        return 'tar'
+    if head[:64].tobytes().lstrip().startswith(XML_HEADS):
+        return 'xml'
+    return None
+
 # Function to check if content is a valid archive format
 def is_archive(content):
-    try:
-        if content.startswith(b'PK\x03\x04'):
-            return 'zip'
-        elif content.startswith(b'\x1f\x8b'):
-            return 'gzip'
-        elif len(content) > 257+5 and content[257:257+5] == b'ustar':
-            return 'tar'
-    except:
-        pass
-    return None
+    content_type = sniff_content(content)
+    return content_type if content_type != 'xml' else None
 
-# Function to extract XML files from an archive
-def extract_xml_from_archive(content, archive_type):
-    xml_files = []
-    
+# Function to extract XML files from an archive. Yields (name, content) pairs
+# one member at a time so each XML can be processed and dropped before the
+# next is decompressed. archive_file is a seekable binary file object.
+def extract_xml_from_archive(archive_file, archive_type):
     try:
         if archive_type == 'zip':
-            with io.BytesIO(content) as content_io:
-                with zipfile.ZipFile(content_io) as zip_ref:
-                    file_list = zip_ref.namelist()
-                    for file_name in file_list:
-                        if file_name.lower().endswith('.xml'):
-                            with zip_ref.open(file_name) as xml_file:
-                                xml_content = xml_file.read()
-                                xml_files.append((file_name, xml_content))
+            with zipfile.ZipFile(archive_file) as zip_ref:
+                # Reading by ZipInfo skips the per-name lookup in the directory
+                members = [info for info in zip_ref.infolist()
+                           if not info.is_dir() and info.filename.lower().endswith('.xml')]
+                # Each read opens its own member handle; zlib releases the
+                # GIL while inflating, so members decompress in parallel. At
+                # most one batch of ARCHIVE_WORKERS members is held at a time.
+                for start in range(0, len(members), ARCHIVE_WORKERS):
+                    batch = members[start:start + ARCHIVE_WORKERS]
+                    yield from archive_executor.map(lambda info: (info.filename, zip_ref.read(info)), batch)
         
         elif archive_type == 'gzip':
-            with io.BytesIO(content) as content_io:
-                with gzip.GzipFile(fileobj=content_io) as gz_file:
-                    extracted_content = gz_file.read()
-                    if extracted_content.startswith(b'<?xml'):
-                        xml_files.append(("extracted.xml", extracted_content))
+            with gzip.GzipFile(fileobj=archive_file) as gz_file:
+                # Only inflate the rest once the head looks like a keybox
+                head = gz_file.read(KEYBOX_SNIFF_SIZE)
+                if head.startswith(XML_HEADS) and head.find(KEYBOX_SENTINEL) >= 0:
+                    # Inflate the rest through one reused chunk buffer straight
+                    # onto the payload, which is handed on as a bytearray
+                    payload = bytearray(head)
+                    chunk = bytearray(DOWNLOAD_CHUNK_SIZE)
+                    view = memoryview(chunk)
+                    while True:
+                        n = gz_file.readinto(chunk)
+                        if not n:
+                            break
+                        payload += view[:n]
+                    yield "extracted.xml", payload
         
         elif archive_type == 'tar':
-            with io.BytesIO(content) as content_io:
-                with tarfile.open(fileobj=content_io, mode='r') as tar_ref:
-                    for member in tar_ref.getmembers():
-                        if member.name.lower().endswith('.xml'):
-                            f = tar_ref.extractfile(member)
-                            if f:
-                                xml_content = f.read()
-                                xml_files.append((member.name, xml_content))
+            # Stream mode walks the members once, front to back, and
+            # never seeks back for skipped (non-XML) entries
+            with tarfile.open(fileobj=archive_file, mode='r|*') as tar_ref:
+                for member in tar_ref:
+                    if member.isfile() and member.name.lower().endswith('.xml'):
+                        f = tar_ref.extractfile(member)
+                        if f:
+                            yield member.name, f.read()
     
     except Exception as e:
         logger.error(f"Error extracting from archive: {e}")
+
+# Read-only file object backed by HTTP Range requests. zipfile only needs the
+# end-of-central-directory record, the central directory and the members we
+# open, so large remote ZIPs never have to be downloaded in full. Every range
+# request is paced and counted against its host like any other download.
+class RangeReader(io.RawIOBase):
+    def __init__(self, url, size, headers=None):
+        self.url = url
+        self.size = size
+        self.headers = headers or {}
+        self.position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+    
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if self.position >= end:
+            return 0
+        throttle(self.url)
+        with host_slot(self.url):
+            response = session.get(
+                self.url,
+                headers={**self.headers, "Range": f"bytes={self.position}-{end - 1}", "Accept-Encoding": "identity"},
+                timeout=20
+            )
+        if response.status_code != 206:
+            raise OSError(f"Range request failed for {self.url}: {response.status_code}")
+        data = response.content
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+# Remote ZIPs at least this large are scanned through RangeReader
+REMOTE_ZIP_MIN_SIZE = 1024 * 1024
+
+# Streamed downloads are read in blocks of this size
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Archives larger than this are spooled to disk rather than kept in memory
+ARCHIVE_SPOOL_SIZE = 8 * 1024 * 1024
+
+# Function to get the size of a remote file if the server supports byte ranges
+def get_remote_range_size(url, headers=None):
+    throttle(url)
+    try:
+        with host_slot(url):
+            response = session.head(
+                url, headers={**(headers or {}), "Accept-Encoding": "identity"}, allow_redirects=True, timeout=10
+            )
+    except requests.RequestException as e:
+        logger.debug(f"HEAD request failed for {url}: {e}")
+        return None
+    
+    if response.status_code != 200 or response.headers.get("Accept-Ranges", "").lower() != "bytes":
+        return None
+    try:
+        return int(response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+# Errors that end a remote ZIP scan early; the caller falls back to a full download
+REMOTE_ZIP_ERRORS = (zipfile.BadZipFile, OSError, requests.RequestException)
+
+# Function to extract XML files from a remote ZIP without downloading all of
+# it; raises one of REMOTE_ZIP_ERRORS if a range request or the archive fails
+def extract_xml_from_remote_zip(url, size, headers=None):
+    with io.BufferedReader(RangeReader(url, size, headers), buffer_size=64 * 1024) as remote_file:
+        with zipfile.ZipFile(remote_file) as zip_ref:
+            for info in zip_ref.infolist():
+                if not info.is_dir() and info.filename.lower().endswith('.xml'):
+                    with zip_ref.open(info) as xml_file:
+                        yield info.filename, xml_file.read()
+
+# Parser target that feeds canonical XML straight into SHA-256 while the
+# document is parsed, so no tree or canonical copy is ever built. Comments and
+# PIs outside the root are dropped to match etree.tostring(root, method="c14n").
+class CanonicalHashTarget(etree.C14NWriterTarget):
+    def __init__(self):
+        self._hash = hashlib.new("sha256", usedforsecurity=False)
+        self._depth = 0
+        self.has_namespaces = False
+        super().__init__(self._write, with_comments=True)
+    
+    def _write(self, chunk):
+        self._hash.update(chunk.encode())
+    
+    def start_ns(self, prefix, uri):
+        self.has_namespaces = True
+        return super().start_ns(prefix, uri)
+    
+    def start(self, tag, attrs):
+        self._depth += 1
+        return super().start(tag, attrs)
+    
+    def end(self, tag):
+        self._depth -= 1
+        return super().end(tag)
+    
+    def comment(self, text):
+        if self._depth:
+            return super().comment(text)
     
-    return xml_files
+    def pi(self, target, data=None):
+        if self._depth:
+            return super().pi(target, data)
+    
+    def close(self):
+        return self._hash.hexdigest()
+
+# Function to compute the file-naming digest of an XML document
+def canonical_digest(content):
+    target = CanonicalHashTarget()
+    hash_value = etree.fromstring(content, etree.XMLParser(target=target))
+    # The streaming writer is C14N 2.0, which places namespace declarations
+    # differently; keep the tree path for namespaced documents so the
+    # digest (and the saved file name) never changes
+    if not target.has_namespaces:
+        return hash_value
+    
+    root = etree.fromstring(content)
+    canonical_xml = etree.tostring(root, method="c14n")
+    # One update over the whole canonical buffer keeps OpenSSL on its
+    # SHA-NI fast path; the digest only names files, not a security check
+    return hashlib.new("sha256", canonical_xml, usedforsecurity=False).hexdigest()
+
+# Raw digests of every keybox payload processed during this run
+seen_contents = set()
+seen_content_lock = threading.Lock()
 
 # Function to process XML content
 def process_xml_content(url, file_name, content):
+    if content.find(KEYBOX_SENTINEL, 0, KEYBOX_SNIFF_SIZE) < 0:
+        logger.info(f"Not a keybox, skipping: {url}/{file_name}")
+        return False
+    
+    # The same keybox is often mirrored byte for byte across repos and
+    # archives; a raw digest skips parsing, hashing and validating it again
+    raw_digest = hashlib.blake2b(content, digest_size=16).digest()
+    with seen_content_lock:
+        if raw_digest in seen_contents:
+            logger.info(f"Already processed this run, skipping: {url}/{file_name}")
+            return False
+        seen_contents.add(raw_digest)
+    
     try:
-        root = etree.fromstring(content)
-        canonical_xml = etree.tostring(root, method="c14n")
-        hash_value = hashlib.sha256(canonical_xml).hexdigest()
-        file_name_save = save / (hash_value + ".xml")
+        hash_value = canonical_digest(content)
         
         # Check validity
         try:
@@ -328,10 +795,12 @@ def process_xml_content(url, file_name, content):
             logger.error(f"Error validating XML: {check_error}")
             is_valid = False
             
-        if not file_name_save.exists() and is_valid:
+        if is_valid:
+            try:
+                write_new_keybox(hash_value + ".xml", content)
+            except FileExistsError:
+                return False
             logger.info(f"Found new valid XML: {url}/{file_name}")
-            with open(file_name_save, "wb") as f:
-                f.write(content)
             return True
     except Exception as e:
         logger.error(f"Error processing XML content from {url}/{file_name}: {e}")
@@ -349,64 +818,68 @@ def search_github():
         logger.warning(f"Only {rate_limit_info.get('remaining')} GitHub API requests remaining. Skipping GitHub search.")
         return
     
-    for ext in SUPPORTED_EXTENSIONS:
-        query = f"{SEARCH_TERM} extension:{ext[1:]}"
-        search_url = f"https://api.github.com/search/code?q={query}"
-        
-        logger.info(f"Searching GitHub for: {query}")
-        
-        page = 1
-        has_more = True
-        while has_more:
-            # Check rate limit again before each page
-            if page > 1:
-                rate_check = check_github_rate_limit()
-                if rate_check.get("remaining", 0) < 10:
-                    logger.warning(f"Only {rate_check.get('remaining')} GitHub API requests remaining. Stopping GitHub search.")
-                    return
+    logger.info(f"Searching GitHub for: {GITHUB_CODE_QUERY}")
+    
+    page = 1
+    has_more = True
+    search_remaining = None
+    while has_more:
+        # Every search response reports the remaining search quota, so
+        # no extra /rate_limit call is spent before each page
+        if search_remaining is not None and search_remaining < 1:
+            logger.warning("GitHub search rate limit exhausted. Stopping GitHub search.")
+            return
+        
+        params = {"per_page": 100, "page": page}
+        throttle(GITHUB_CODE_SEARCH_URL)
+        response = session.get(GITHUB_CODE_SEARCH_URL, params=params)
+        
+        if response.status_code == 403 and 'rate limit exceeded' in response.text.lower():
+            logger.warning("GitHub API rate limit exceeded")
+            return
+        
+        if "X-RateLimit-Remaining" in response.headers:
+            search_remaining = int(response.headers["X-RateLimit-Remaining"])
+        
+        if response.status_code != 200:
+            logger.error(f"GitHub search failed: {response.status_code} - {response.text}")
+            time.sleep(5)
+            break
             
-            params = {"per_page": 100, "page": page}
-            response = session.get(search_url, params=params)
+        try:
+            search_results = response.json()
             
-            if response.status_code == 403 and 'rate limit exceeded' in response.text.lower():
-                logger.warning("GitHub API rate limit exceeded")
-                return
+            if "items" not in search_results or len(search_results["items"]) == 0:
+                has_more = False
+                continue
             
-            if response.status_code != 200:
-                logger.error(f"GitHub search failed: {response.status_code} - {response.text}")
-                time.sleep(5)
-                break
+            # A short page is the last one, and GitHub serves at most
+            # GITHUB_SEARCH_MAX_RESULTS per query; decide before fetching
+            # the files so no request is spent on a page that cannot exist
+            if len(search_results["items"]) < 100 or page * 100 >= GITHUB_SEARCH_MAX_RESULTS:
+                has_more = False
                 
-            try:
-                search_results = response.json()
+            raw_urls = []
+            for item in search_results["items"]:
+                raw_url = (
+                    item["html_url"]
+                    .replace("github.com", "raw.githubusercontent.com")
+                    .replace("/blob/", "/")
+                )
                 
-                if "items" not in search_results or len(search_results["items"]) == 0:
-                    has_more = False
+                if not has_supported_extension(raw_url) or url_key(raw_url) in cached_urls:
                     continue
-                    
-                for item in search_results["items"]:
-                    raw_url = (
-                        item["html_url"]
-                        .replace("github.com", "raw.githubusercontent.com")
-                        .replace("/blob/", "/")
-                    )
-                    
-                    if raw_url + "\n" in cached_urls:
-                        continue
-                        
-                    process_url(raw_url)
-                    cached_urls.add(raw_url + "\n")
-                    time.sleep(1)
-                
-                page += 1
-                time.sleep(3)
                 
-            except Exception as e:
-                logger.error(f"Error processing GitHub search results: {e}")
-                has_more = False
+                raw_urls.append(raw_url)
             
-            if "items" in search_results and len(search_results["items"]) < 100:
-                has_more = False
+            # Download the whole page of results concurrently
+            process_urls(raw_urls)
+            
+            page += 1
+            
+        except Exception as e:
+            logger.error(f"Error processing GitHub search results: {e}")
+            has_more = False
 # Enhanced process_repository function
 def process_repository(repo_url):
     """Process a specific GitHub repository to find keybox files."""
@@ -447,7 +920,7 @@ def process_repository(repo_url):
             response = session.get(path, timeout=10)
             if response.status_code == 200:
                 content = response.content
-                if b'<?xml' in content[:100]:
+                if content.startswith(XML_HEADS):
                     process_xml_content(path, os.path.basename(path), content)
         except Exception as e:
             logger.debug(f"Error with direct path {path}: {e}")
@@ -465,12 +938,13 @@ def process_repository(repo_url):
     for archive_path in common_archives:
         try:
             logger.info(f"Trying direct archive path: {archive_path}")
-            response = session.get(archive_path, timeout=20)
-            if response.status_code == 200:
-                content = response.content
-                archive_type = is_archive(content)
-                if archive_type:
-                    process_archive(archive_path, content, archive_type)
+            with session.get(archive_path, timeout=20, stream=True) as response:
+                if response.status_code == 200:
+                    chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+                    head = read_head(chunks)
+                    archive_type = is_archive(head)
+                    if archive_type:
+                        spool_archive(archive_path, head, chunks, archive_type)
         except Exception as e:
             logger.debug(f"Error with archive path {archive_path}: {e}")
     
@@ -509,6 +983,7 @@ def process_repo_contents(contents, owner, repo, path="", depth=0):
         logger.error(f"Only {rate_limit_info.get('remaining')} GitHub API requests remaining. Stopping repository processing.")
         return
         
+    raw_urls = []
     for item in contents:
         if item['type'] == 'dir':
             # Skip certain directories that are unlikely to contain keyboxes
@@ -543,7 +1018,7 @@ def process_repo_contents(contents, owner, repo, path="", depth=0):
                 
         elif item['type'] == 'file':
             file_name = item['name'].lower()
-            if any(file_name.endswith(ext) for ext in SUPPORTED_EXTENSIONS):
+            if file_name.endswith(SUPPORTED_EXTENSIONS):
                 # Construct raw URL for the file
                 if path:
                     raw_url = f"https://raw.githubusercontent.com/{owner}/{repo}/main/{path}/{item['name']}"
@@ -553,149 +1028,125 @@ def process_repo_contents(contents, owner, repo, path="", depth=0):
                 logger.info(f"Found file with supported extension: {raw_url}")
                 
                 # Check if we've already processed this URL
-                if raw_url + "\n" in cached_urls:
+                if url_key(raw_url) in cached_urls:
                     logger.info(f"Skipping already processed URL: {raw_url}")
                     continue
                 
-                # Process the URL
-                process_url(raw_url)
-                cached_urls.add(raw_url + "\n")
-                time.sleep(1)  # Be nice to GitHub
+                raw_urls.append(raw_url)
+    
+    # Download the files found at this level concurrently
+    process_urls(raw_urls)
+
+# Result link extractors, compiled once per engine
+RESULT_LINK_XPATHS = {
+    "google": etree.XPath('//a[starts-with(@href, "/url?")]/@href'),
+    "bing": etree.XPath('//a[starts-with(@href, "http")]/@href'),
+    "duckduckgo": etree.XPath('//a[contains(concat(" ", normalize-space(@class), " "), " result__a ")]/@href'),
+    "ecosia": etree.XPath('//a[contains(concat(" ", normalize-space(@class), " "), " result-url ")]/@href'),
+}
+
+# Target URL parameters of Google and DuckDuckGo redirect links; pulled out
+# directly instead of parsing every href into a query dict
+GOOGLE_TARGET_RE = re.compile(r'[?&]q=([^&#]+)')
+DUCKDUCKGO_TARGET_RE = re.compile(r'[?&]uddg=([^&#]+)')
+
 # Extract URLs from search engine results
 def extract_urls_from_html(html, search_engine):
-    soup = BeautifulSoup(html, 'html.parser')
     result_urls = []
+    extractor = RESULT_LINK_XPATHS.get(search_engine)
+    if extractor is None:
+        return result_urls
+    
+    try:
+        hrefs = extractor(lhtml.fromstring(html))
+    except (etree.ParserError, ValueError) as e:
+        logger.error(f"Error parsing {search_engine} results: {e}")
+        return result_urls
     
     if search_engine == "google":
-        for result in soup.select('a[href^="/url?"]'):
-            href = result.get('href')
-            if href:
-                url_params = parse_qs(urlparse(href).query)
-                if 'q' in url_params:
-                    url = url_params['q'][0]
-                    if has_supported_extension(url):
-                        result_urls.append(url)
+        for href in hrefs:
+            match = GOOGLE_TARGET_RE.search(href)
+            if match:
+                url = unquote_plus(match.group(1))
+                if has_supported_extension(url):
+                    result_urls.append(url)
     
     elif search_engine == "bing":
-        for result in soup.select('a[href^="http"]'):
-            href = result.get('href')
-            if href and not href.startswith('https://www.bing.com/'):
+        for href in hrefs:
+            if not href.startswith('https://www.bing.com/'):
                 if has_supported_extension(href):
                     result_urls.append(href)
     
     elif search_engine == "duckduckgo":
-        for result in soup.select('a.result__a'):
-            href = result.get('href')
-            if href:
-                try:
-                    url_params = parse_qs(urlparse(href).query)
-                    if 'uddg' in url_params:
-                        url = url_params['uddg'][0]
-                        if has_supported_extension(url):
-                            result_urls.append(url)
-                except:
-                    pass
+        for href in hrefs:
+            match = DUCKDUCKGO_TARGET_RE.search(href)
+            if match:
+                url = unquote_plus(match.group(1))
+                if has_supported_extension(url):
+                    result_urls.append(url)
     
     elif search_engine == "ecosia":
-        for result in soup.select('a.result-url'):
-            href = result.get('href')
-            if href and has_supported_extension(href):
+        for href in hrefs:
+            if has_supported_extension(href):
                 result_urls.append(href)
     
     return result_urls
 
-# Function to search using search engines with rate limiting and pagination
-def search_web():
-    search_engines = [
-        {
-            "name": "Google",
-            "id": "google",
-            "url": "https://www.google.com/search",
-            "params": lambda q, page: {"q": q, "num": 100, "start": (page - 1) * 100},
-            "extractor": "google"
-        },
-        {
-            "name": "Bing",
-            "id": "bing",
-            "url": "https://www.bing.com/search",
-            "params": lambda q, page: {"q": q, "count": 50, "first": (page - 1) * 50},
-            "extractor": "bing"
-        },
-        {
-            "name": "DuckDuckGo",
-            "id": "duckduckgo",
-            "url": "https://duckduckgo.com/html/",
-            "params": lambda q, page: {"q": q, "s": (page - 1) * 30},
-            "extractor": "duckduckgo"
-        },
-        {
-            "name": "Ecosia",
-            "id": "ecosia",
-            "url": "https://www.ecosia.org/search",
-            "params": lambda q, page: {"q": q, "p": page - 1},
-            "extractor": "ecosia"
-        }
-    ]
-    
-    max_pages = 2  # Reduced from 3 to 2 to respect rate limits
+# Function to search one engine with rate limiting and pagination
+def search_engine(engine):
+    if not check_rate_limit(engine["id"]):
+        logger.warning(f"{engine['name']} search rate limited. Skipping.")
+        return
+        
+    logger.info(f"Searching {engine['name']} for: {SEARCH_TERM}")
     
-    for engine in search_engines:
-        if not check_rate_limit(engine["id"]):
-            logger.warning(f"{engine['name']} search rate limited. Skipping.")
-            continue
-            
-        logger.info(f"Searching {engine['name']} for: {SEARCH_TERM}")
+    try:
+        # One User-Agent per engine run, sent per request so the shared
+        # session's headers are never mutated by concurrent engines
+        headers = {"User-Agent": random.choice(USER_AGENTS)}
         
-        try:
-            session.headers.update({"User-Agent": random.choice(USER_AGENTS)})
-            
-            if engine["id"] == "duckduckgo":
-                session.headers.update({
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-                    "Upgrade-Insecure-Requests": "1"
-                })
-            
-            for ext in [ext[1:] for ext in SUPPORTED_EXTENSIONS]:
-                if engine["id"] == "duckduckgo":
-                    query = f"{SEARCH_TERM} {ext}"
-                elif engine["id"] == "ecosia":
-                    query = f"{SEARCH_TERM} .{ext}"
-                else:
-                    query = f"{SEARCH_TERM} filetype:{ext}"
+        if engine["id"] == "duckduckgo":
+            headers.update({
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+                "Upgrade-Insecure-Requests": "1"
+            })
+        
+        for query, page_params in engine["queries"]:
+            for page, params in enumerate(page_params, 1):
+                if not check_rate_limit(engine["id"]):
+                    logger.warning(f"Rate limit hit on {engine['name']} page {page}. Moving to next engine.")
+                    return
                 
-                for page in range(1, max_pages + 1):
-                    if not check_rate_limit(engine["id"]):
-                        logger.warning(f"Rate limit hit on {engine['name']} page {page}. Moving to next engine.")
-                        break
-                    
-                    response = session.get(
-                        engine["url"],
-                        params=engine["params"](query, page),
-                        timeout=15
-                    )
-                    
-                    if response.status_code == 200:
-                        urls = extract_urls_from_html(response.text, engine["extractor"])
-                        for url in urls:
-                            process_url(url)
-                            time.sleep(random.uniform(1.5, 3.5))
-                    else:
-                        logger.error(f"{engine['name']} page {page} failed: {response.status_code}")
-                        break
-                    
-                    time.sleep(random.uniform(5, 10))
+                throttle(engine["url"])
+                response = session.get(
+                    engine["url"],
+                    params=params,
+                    headers=headers,
+                    timeout=15
+                )
                 
-                time.sleep(random.uniform(5, 10))
-        
-        except Exception as e:
-            logger.error(f"Error in {engine['name']} search: {e}")
-        
-        time.sleep(random.uniform(10, 15))
+                if response.status_code == 200:
+                    # Hand lxml the raw bytes; it reads the charset from the page
+                    # itself, skipping requests' encoding detection for .text
+                    urls = extract_urls_from_html(response.content, engine["extractor"])
+                    process_urls(urls)
+                else:
+                    logger.error(f"{engine['name']} page {page} failed: {response.status_code}")
+                    break
+    
+    except Exception as e:
+        logger.error(f"Error in {engine['name']} search: {e}")
+
+# Function to search all engines; each engine has its own rate limiter, so
+# they are searched side by side
+def search_web():
+    with ThreadPoolExecutor(max_workers=len(SEARCH_ENGINES), thread_name_prefix="search") as executor:
+        for _ in executor.map(search_engine, SEARCH_ENGINES):
+            pass
+
 # Check if a URL has a supported file extension
 def has_supported_extension(url):
-    parsed_url = urlparse(url)
-    path = parsed_url.path.lower()
-    return any(path.endswith(ext) for ext in SUPPORTED_EXTENSIONS)
+    return SUPPORTED_EXTENSION_RE.match(url) is not None
 
 # Function to process a URL
 def process_url(url):
@@ -704,41 +1155,187 @@ def process_url(url):
         
     logger.info(f"Processing URL: {url}")
     
-    if url + "\n" in cached_urls:
-        return
-        
-    cached_urls.add(url + "\n")
+    # Check and claim the URL atomically; several workers may race for it
+    key = url_key(url)
+    with cache_lock:
+        if key in cached_urls:
+            return
+        cache_add(key)
     
     try:
-        session.headers.update({"User-Agent": random.choice(USER_AGENTS)})
-        response = session.get(url, timeout=20)
+        # Per-request headers; the shared session is used by several workers
+        headers = {"User-Agent": random.choice(USER_AGENTS)}
+        # File type checks look at the path only, not the query or fragment
+        url_path = urlparse(url).path.lower()
         
-        if response.status_code != 200:
-            logger.error(f"Failed to download {url}: {response.status_code}")
-            return
-            
-        content = response.content
+        # Large ZIPs are read member-by-member instead of downloaded whole. If
+        # the range scan fails part way, the URL is downloaded in full below;
+        # members already processed are skipped there by their content digest.
+        if url_path.endswith('.zip'):
+            remote_size = get_remote_range_size(url, headers)
+            if remote_size is not None and remote_size >= REMOTE_ZIP_MIN_SIZE:
+                logger.info(f"Processing remote zip archive from {url} ({remote_size} bytes)")
+                try:
+                    for file_name, xml_content in extract_xml_from_remote_zip(url, remote_size, headers):
+                        process_xml_content(url, file_name, xml_content)
+                    return
+                except REMOTE_ZIP_ERRORS as e:
+                    logger.warning(f"Range scan of {url} failed, downloading it in full: {e}")
         
-        archive_type = is_archive(content)
-        if archive_type:
-            process_archive(url, content, archive_type)
-            return
+        throttle(url)
+        
+        # Stream the body: sniff the first block, spool archives to disk and
+        # drop anything that is neither an archive nor XML without reading on
+        with host_slot(url), session.get(url, headers=headers, timeout=20, stream=True) as response:
+            if response.status_code != 200:
+                logger.error(f"Failed to download {url}: {response.status_code}")
+                return
+            
+            chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+            head = read_head(chunks)
+            
+            content_type = sniff_content(head)
+            if content_type in ('zip', 'gzip', 'tar'):
+                spool_archive(url, head, chunks, content_type)
+                return
             
-        if url.lower().endswith('.xml') or b'<?xml' in content[:100]:
-            process_xml_content(url, os.path.basename(urlparse(url).path), content)
+            if content_type == 'xml' or url_path.endswith('.xml'):
+                content = head + b"".join(chunks)
+                process_xml_content(url, os.path.basename(urlparse(url).path), content)
             
     except Exception as e:
         logger.error(f"Error processing URL {url}: {e}")
 
+# Function to process several URLs concurrently on the download pool
+def process_urls(urls):
+    for _ in url_executor.map(process_url, urls):
+        pass
+
+# Function to read the first block of a streamed download
+def read_head(chunks, size=512):
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= size:
+            break
+    return head
+
+# Function to spool a streamed archive and process it. Archives up to
+# ARCHIVE_SPOOL_SIZE stay in memory; larger ones roll over to a temporary
+# file, so memory use does not grow with the size of the archive.
+def spool_archive(url, head, chunks, archive_type):
+    with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as archive_file:
+        archive_file.write(head)
+        for chunk in chunks:
+            archive_file.write(chunk)
+        archive_file.seek(0)
+        process_archive(url, archive_file, archive_type)
+
 # Function to process an archive file
-def process_archive(url, content, archive_type):
+def process_archive(url, archive_file, archive_type):
     logger.info(f"Processing {archive_type} archive from {url}")
-    xml_files = extract_xml_from_archive(content, archive_type)
-    
-    for file_name, xml_content in xml_files:
+    for file_name, xml_content in extract_xml_from_archive(archive_file, archive_type):
         process_xml_content(url, file_name, xml_content)
+
+# Function to re-check one stored keybox; runs in a worker process and
+# returns the path with None when valid, or the reason it is not
+def validate_keybox_file(file_path):
+    try:
+        if CheckValid(file_path.read_bytes()):
+            return file_path, None
+        return file_path, "keybox check failed"
+    except Exception as e:
+        return file_path, f"validation error: {e}"
+
+# Function to list stored keybox files. os.scandir reports each entry's type
+# from the directory listing itself, so filtering needs no stat() per file.
+def scan_keybox_files():
+    with os.scandir(save) as entries:
+        for entry in entries:
+            if entry.name.endswith('.xml') and entry.is_file(follow_symlinks=False):
+                yield entry
+
+# Function to get the multiprocessing context for keybox validation. Forking
+# this process would copy its live download pools, lock states and open
+# files into every worker. Under forkserver, workers fork from a clean
+# single-threaded server that imports this module, and check.py with it, once.
+# Where forkserver is unavailable (Windows), spawn is used.
+def validation_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+# Function to re-check every stored keybox, yielding (path, reason) pairs.
+# Files unchanged since a check within VALIDITY_TTL reuse the cached result
+# from validity.db; the rest are checked on a process pool.
+def validate_stored_keyboxes():
+    conn = sqlite3.connect(validity_db)
+    try:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS validity (
+            path TEXT PRIMARY KEY,
+            mtime REAL,
+            size INTEGER,
+            reason TEXT,
+            checked_at REAL
+        )
+        ''')
+        
+        cutoff = time.time() - VALIDITY_TTL
+        pending = {}
+        for entry in scan_keybox_files():
+            file_path = Path(entry.path)
+            st = entry.stat()
+            row = conn.execute(
+                "SELECT reason FROM validity WHERE path = ? AND mtime = ? AND size = ? AND checked_at > ?",
+                (file_path.name, st.st_mtime, st.st_size, cutoff)
+            ).fetchone()
+            if row:
+                yield file_path, row[0]
+            else:
+                pending[file_path] = st
+        
+        if not pending:
+            return
+        logger.info(f"Validating {len(pending)} new or changed keybox files")
+        
+        # Certificate chain checks are CPU-bound, so spread them over all cores
+        with validation_context().Pool() as pool:
+            for file_path, reason in pool.imap_unordered(validate_keybox_file, pending, chunksize=16):
+                # Errors may be transient, so only definite results are cached
+                if reason is None or not reason.startswith("validation error"):
+                    st = pending[file_path]
+                    conn.execute(
+                        "INSERT OR REPLACE INTO validity (path, mtime, size, reason, checked_at) VALUES (?, ?, ?, ?, ?)",
+                        (file_path.name, st.st_mtime, st.st_size, reason, time.time())
+                    )
+                yield file_path, reason
+        conn.commit()
+    finally:
+        conn.close()
+
+# Write the invalid keybox report and optionally delete the listed files
+def write_invalid_report(invalid_files, purge=False):
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "purged": purge,
+        "invalid": [{"file": file_path.name, "reason": reason} for file_path, reason in invalid_files]
+    }
+    with open(invalid_report_file, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote {len(invalid_files)} invalid keybox entries to {invalid_report_file}")
+    
+    if purge:
+        for file_path, _ in invalid_files:
+            file_path.unlink(missing_ok=True)
+        logger.info(f"Purged {len(invalid_files)} invalid keybox files")
+    elif invalid_files:
+        logger.info("Run with --purge to delete them")
+
 # Main execution
-def main():
+def main(purge=False):
     save.mkdir(exist_ok=True)
     
     logger.info("Starting KeyBoxer search (XML and archives only)")
@@ -833,23 +1430,20 @@ def main():
         except Exception as e:
             logger.error(f"Error in web search: {e}")
         
-        # Always save the cache and validate files
-        logger.info("Saving cache and validating files...")
-        with open(cache_file, "w") as f:
-            f.writelines(cached_urls)
+        # Always validate files; the cache is already on disk
+        logger.info("Validating files...")
         
         valid_files = 0
-        for file_path in save.glob("*.xml"):
-            try:
-                file_content = file_path.read_bytes()
-                if CheckValid(file_content):
-                    valid_files += 1
-                else:
-                    logger.warning(f"File '{file_path.name}' is not valid.")
-            except Exception as e:
-                logger.error(f"Error validating file {file_path}: {e}")
+        invalid_files = []
+        for file_path, reason in validate_stored_keyboxes():
+            if reason is None:
+                valid_files += 1
+            else:
+                logger.warning(f"File '{file_path.name}' is not valid: {reason}")
+                invalid_files.append((file_path, reason))
         
         logger.info(f"KeyBoxer completed. Found {valid_files} valid keybox files.")
+        write_invalid_report(invalid_files, purge)
     
     except KeyboardInterrupt:
         logger.info("Search interrupted by user")
@@ -858,11 +1452,12 @@ def main():
     finally:
         # Save progress even on error
         try:
-            with open(rate_limit_file, "w") as f:
-                json.dump(rate_limits, f)
+            save_rate_limits()
+            if cache_needs_compaction:
+                compact_cache()
             
             # Count files found
-            file_count = len(list(save.glob("*.xml")))
+            file_count = sum(1 for _ in scan_keybox_files())
             logger.info(f"Found {file_count} keybox files in total.")
             
             # Create a summary file
@@ -880,6 +1475,10 @@ def main():
         logger.info("KeyBoxer completed")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search for and validate keybox.xml files")
+    parser.add_argument("--purge", action="store_true", help="delete keybox files that fail validation")
+    args = parser.parse_args()
+    
     # Set up error handling for the entire script
     try:
         # Print Python version and environment info for debugging
@@ -887,7 +1486,7 @@ if __name__ == "__main__":
         logger.info(f"Current working directory: {os.getcwd()}")
         
         # Run the main function
-        main()
+        main(purge=args.purge)
     except Exception as e:
         logger.critical(f"Fatal error in script execution: {e}", exc_info=True)
         sys.exit(1)
\ No newline at end of file
@@ -13,6 +13,9 @@ import re
 import zipfile
 import gzip
 import tarfile
+import itertools
+import queue
+import threading
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
@@ -57,9 +60,40 @@ TELEGRAM_DB = BASE_DIR / "telegram_data.db"
 STATE_FILE = BASE_DIR / "telegram_state.json"
 
 # XML-related patterns
-XML_PATTERN = re.compile(r'<AndroidAttestation>|<KeyAttestationStatement>|<KeyboxInfo>|<NumberOfCertificates>', re.IGNORECASE)
-XML_FILE_PATTERN = re.compile(r'.*\.xml$', re.IGNORECASE)
-ARCHIVE_EXTENSIONS = ['.zip', '.gz', '.tar', '.tgz', '.tar.gz']
+XML_PATTERN = re.compile(rb'<AndroidAttestation>|<KeyAttestationStatement>|<KeyboxInfo>|<NumberOfCertificates>', re.IGNORECASE)
+ARCHIVE_SUFFIXES = ('.zip', '.gz', '.tar', '.tgz', '.tar.gz')
+ARCHIVE_MAGIC = {
+    b'PK\x03\x04': 'zip',
+    b'\x1f\x8b': 'gzip',
+}
+XML_HEAD = b'<?xml'
+ATTESTATION_TAG = b'<AndroidAttestation>'
+XML_START_PATTERN = re.compile(r'<\?xml|<AndroidAttestation>')
+
+# Largest XML file read out of an archive
+MAX_XML_SIZE = 16 * 1024 * 1024
+
+# Resolved input peers and titles of scraped channels, keyed by channel id
+entity_cache = {}
+
+# Largest document downloaded from a message, and media types never worth downloading
+MAX_DOCUMENT_SIZE = 32 * 1024 * 1024
+SKIPPED_MIME_PREFIXES = ('video/', 'audio/', 'image/')
+
+# Number of media downloads a channel scrape runs at once
+MEDIA_DOWNLOAD_CONCURRENCY = 4
+
+# Media is streamed in chunks of this size. Files not named like XML or an archive
+# are abandoned when their first MEDIA_SNIFF_SIZE bytes show no keybox signature.
+MEDIA_CHUNK_SIZE = 128 * 1024
+MEDIA_SNIFF_SIZE = 1024 * 1024
+
+# Named XML and archive files above this size are fetched over several chunk streams at once
+PARALLEL_DOWNLOAD_MIN_SIZE = 1024 * 1024
+PARALLEL_DOWNLOAD_STREAMS = 4
+
+# Maximum number of queued writes applied to the database per transaction
+DB_BATCH_SIZE = 200
 
 def load_state():
     """Load the state from the JSON file."""
@@ -81,6 +115,9 @@ def setup_database():
     conn = sqlite3.connect(TELEGRAM_DB)
     c = conn.cursor()
     
+    # WAL mode is stored in the database file, so every later connection uses it
+    c.execute('PRAGMA journal_mode=WAL')
+    
     # Create tables if they don't exist
     c.execute('''
     CREATE TABLE IF NOT EXISTS channels (
@@ -121,6 +158,9 @@ def setup_database():
     )
     ''')
     
+    # The UNIQUE constraints already index messages(channel_id, message_id) and keyboxes(hash)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_messages_unprocessed ON messages(processed) WHERE processed = 0')
+    
     conn.commit()
     conn.close()
 
@@ -152,73 +192,167 @@ def get_channels():
     conn.close()
     return channels
 
-def update_channel_last_message(channel_id, message_id):
-    """Update the last processed message ID for a channel."""
-    conn = sqlite3.connect(TELEGRAM_DB)
-    c = conn.cursor()
-    
-    c.execute(
-        'UPDATE channels SET last_message_id = ? WHERE channel_id = ?',
-        (message_id, channel_id)
-    )
-    
-    conn.commit()
-    conn.close()
+def open_database():
+    """Open a connection to the database in WAL mode."""
+    conn = sqlite3.connect(TELEGRAM_DB, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA mmap_size=268435456')
+    return conn
 
-def save_message(channel_id, message):
-    """Save a message to the database."""
-    conn = sqlite3.connect(TELEGRAM_DB)
-    c = conn.cursor()
-    
-    try:
-        # Get sender info
-        if message.sender:
-            sender_id = message.sender.id
-            username = message.sender.username
-        else:
-            sender_id = None
-            username = None
+# Statements run by the database writer thread, in the order they are applied
+WRITER_STATEMENTS = {
+    'msg': '''
+    INSERT OR IGNORE INTO messages
+    (channel_id, message_id, date, sender_id, username, message, media_type, processed)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    'keybox': '''
+    INSERT INTO keyboxes (message_id, channel_id, hash, file_path, valid) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(hash) DO UPDATE SET valid = excluded.valid, file_path = COALESCE(excluded.file_path, file_path)
+    ''',
+    'keybox_flag': 'UPDATE messages SET keybox_found = 1, keybox_valid = ? WHERE channel_id = ? AND message_id = ?',
+    'proc': 'UPDATE messages SET processed = 1, media_path = COALESCE(?, media_path) WHERE channel_id = ? AND message_id = ?',
+    'last_id': 'UPDATE channels SET last_message_id = ? WHERE channel_id = ?',
+    'channel_name': 'UPDATE channels SET channel_name = ? WHERE channel_id = ?',
+}
+
+class DBWriter(threading.Thread):
+    """Apply the database writes of a scrape on a dedicated thread.
+
+    Coroutines queue row tuples and return immediately; the thread drains the
+    queue in batches and applies each batch with executemany in one transaction.
+    """
+
+    def __init__(self, batch_size=DB_BATCH_SIZE):
+        super().__init__(name="telegram-db-writer", daemon=True)
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        
+        # Hashes of keyboxes already recorded, mapped to their validity
+        conn = open_database()
+        try:
+            self.seen_hashes = {hash_value: bool(valid) for hash_value, valid in conn.execute('SELECT hash, valid FROM keyboxes')}
+        finally:
+            conn.close()
             
-        # Determine media type
-        media_type = None
-        if message.media:
-            media_type = message.media.__class__.__name__
+        self.start()
+
+    def submit(self, op, row):
+        self.queue.put_nowait((op, row))
+
+    def queue_message(self, row):
+        self.submit('msg', row)
+
+    def queue_keybox(self, channel_id, message_id, hash_value, file_path, valid):
+        self.seen_hashes[hash_value] = valid
+        self.submit('keybox', (message_id, channel_id, hash_value, file_path, valid))
+        self.queue_keybox_flag(channel_id, message_id, valid)
+
+    def queue_keybox_flag(self, channel_id, message_id, valid):
+        self.submit('keybox_flag', (valid, channel_id, message_id))
+
+    def queue_processed(self, channel_id, message_id, media_path=None):
+        self.submit('proc', (media_path, channel_id, message_id))
+
+    def queue_last_id(self, channel_id, message_id):
+        self.submit('last_id', (message_id, channel_id))
+
+    def update_channel_name(self, channel_id, channel_name):
+        self.submit('channel_name', (channel_name, channel_id))
+
+    def run(self):
+        conn = open_database()
+        try:
+            running = True
+            while running:
+                # Block for the first item, then take whatever else is already queued
+                items = [self.queue.get()]
+                while len(items) < self.batch_size:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                    
+                batch = {op: [] for op in WRITER_STATEMENTS}
+                for item in items:
+                    if item is None:
+                        running = False
+                    else:
+                        batch[item[0]].append(item[1])
+                        
+                self.write_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def write_batch(self, conn, batch):
+        """Write one drained batch in a single transaction."""
+        if not any(batch.values()):
+            return
             
-        # Insert message data
-        c.execute('''
-        INSERT OR IGNORE INTO messages 
-        (channel_id, message_id, date, sender_id, username, message, media_type, processed)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            channel_id,
-            message.id,
-            message.date.strftime('%Y-%m-%d %H:%M:%S'),
-            sender_id,
-            username,
-            message.text if message.text else "",
-            media_type,
-            False
-        ))
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for op, sql in WRITER_STATEMENTS.items():
+                    if batch[op]:
+                        conn.executemany(sql, batch[op])
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.error(f"Error writing batch to database: {e}")
+
+    def close(self):
+        """Write everything still queued and stop the thread."""
+        self.queue.put_nowait(None)
+        self.join()
+
+def save_message(writer, channel_id, message):
+    """Queue a message for insertion into the database."""
+    # Get sender info
+    if message.sender:
+        sender_id = message.sender.id
+        username = message.sender.username
+    else:
+        sender_id = None
+        username = None
         
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(f"Error saving message to database: {e}")
-    finally:
-        conn.close()
+    # Determine media type
+    media_type = None
+    if message.media:
+        media_type = message.media.__class__.__name__
+        
+    writer.queue_message((
+        channel_id,
+        message.id,
+        message.date.replace(tzinfo=None).isoformat(sep=' ', timespec='seconds'),
+        sender_id,
+        username,
+        message.text if message.text else "",
+        media_type,
+        False
+    ))
 
 def is_archive(content):
     """Check if content is a valid archive format."""
-    try:
-        if content.startswith(b'PK\x03\x04'):
-            return 'zip'
-        elif content.startswith(b'\x1f\x8b'):
-            return 'gzip'
-        elif len(content) > 257+5 and content[257:257+5] == b'ustar':
-            return 'tar'
-    except:
-        pass
+    archive_type = ARCHIVE_MAGIC.get(content[:4]) or ARCHIVE_MAGIC.get(content[:2])
+    if archive_type:
+        return archive_type
+    if content[257:262] == b'ustar':
+        return 'tar'
     return None
 
+def read_bounded(file_obj, limit=MAX_XML_SIZE):
+    """Read at most limit bytes from a file object, returning None if it holds more."""
+    data = file_obj.read(limit + 1)
+    if len(data) > limit:
+        return None
+    return data
+
 def extract_xml_from_archive(content, archive_type):
     """Extract XML files from an archive."""
     xml_files = []
@@ -227,24 +361,30 @@ def extract_xml_from_archive(content, archive_type):
         if archive_type == 'zip':
             with io.BytesIO(content) as content_io:
                 with zipfile.ZipFile(content_io) as zip_ref:
-                    file_list = zip_ref.namelist()
-                    for file_name in file_list:
-                        if file_name.lower().endswith('.xml'):
-                            with zip_ref.open(file_name) as xml_file:
-                                xml_content = xml_file.read()
-                                xml_files.append((file_name, xml_content))
+                    for info in zip_ref.infolist():
+                        if not info.filename.lower().endswith('.xml') or info.file_size > MAX_XML_SIZE:
+                            continue
+                        with zip_ref.open(info) as xml_file:
+                            xml_content = read_bounded(xml_file)
+                        if xml_content is not None:
+                            xml_files.append((info.filename, xml_content))
         
         elif archive_type == 'gzip':
             with io.BytesIO(content) as content_io:
                 with gzip.GzipFile(fileobj=content_io) as gz_file:
-                    extracted_content = gz_file.read()
-                    if extracted_content.startswith(b'<?xml'):
-                        xml_files.append(("extracted.xml", extracted_content))
+                    # Only inflate the rest once the head looks like XML
+                    head = gz_file.read(len(XML_HEAD))
+                    if head == XML_HEAD:
+                        rest = read_bounded(gz_file, MAX_XML_SIZE - len(head))
+                        if rest is not None:
+                            xml_files.append(("extracted.xml", head + rest))
         
         elif archive_type == 'tar':
             with io.BytesIO(content) as content_io:
                 with tarfile.open(fileobj=content_io, mode='r') as tar_ref:
-                    for member in tar_ref.getmembers():
+                    for member in tar_ref:
+                        if not member.isfile() or member.size > MAX_XML_SIZE:
+                            continue
                         if member.name.lower().endswith('.xml'):
                             f = tar_ref.extractfile(member)
                             if f:
@@ -256,18 +396,26 @@ def extract_xml_from_archive(content, archive_type):
     
     return xml_files
 
-def process_potential_keybox(content, channel_id, message_id):
+def process_potential_keybox(writer, content, channel_id, message_id):
     """Process content that might be a keybox.xml."""
     try:
         # Check if this is valid XML and potentially a keybox
-        if not XML_PATTERN.search(content.decode('utf-8', errors='ignore')):
+        if not XML_PATTERN.search(content):
             return False
             
+        # Generate hash for the content
+        hash_value = hashlib.sha256(content, usedforsecurity=False).hexdigest()
+        
+        # Skip validation for keyboxes we have already recorded
+        if hash_value in writer.seen_hashes:
+            is_valid = writer.seen_hashes[hash_value]
+            writer.queue_keybox_flag(channel_id, message_id, is_valid)
+            logger.info(f"Found known keybox {hash_value} in message {message_id} from channel {channel_id}")
+            return is_valid
+            
         # Attempt to validate keybox
         is_valid = keybox_check(content)
         
-        # Generate hash for the content
-        hash_value = hashlib.sha256(content).hexdigest()
         file_path = KEYS_DIR / f"{hash_value}.xml"
         
         # Store valid keybox
@@ -275,42 +423,13 @@ def process_potential_keybox(content, channel_id, message_id):
             with open(file_path, "wb") as f:
                 f.write(content)
                 
-            # Update database
-            conn = sqlite3.connect(TELEGRAM_DB)
-            c = conn.cursor()
-            
-            c.execute(
-                'UPDATE messages SET keybox_found = 1, keybox_valid = 1 WHERE channel_id = ? AND message_id = ?',
-                (channel_id, message_id)
-            )
-            
-            c.execute(
-                'INSERT OR IGNORE INTO keyboxes (message_id, channel_id, hash, file_path, valid) VALUES (?, ?, ?, ?, ?)',
-                (message_id, channel_id, hash_value, str(file_path), True)
-            )
-            
-            conn.commit()
-            conn.close()
+            writer.queue_keybox(channel_id, message_id, hash_value, str(file_path), True)
             
             logger.info(f"Found valid keybox in message {message_id} from channel {channel_id}. Saved to {file_path}")
             return True
         else:
             # Still record that we found a keybox but it was invalid
-            conn = sqlite3.connect(TELEGRAM_DB)
-            c = conn.cursor()
-            
-            c.execute(
-                'UPDATE messages SET keybox_found = 1, keybox_valid = 0 WHERE channel_id = ? AND message_id = ?',
-                (channel_id, message_id)
-            )
-            
-            c.execute(
-                'INSERT OR IGNORE INTO keyboxes (message_id, channel_id, hash, file_path, valid) VALUES (?, ?, ?, ?, ?)',
-                (message_id, channel_id, hash_value, None, False)
-            )
-            
-            conn.commit()
-            conn.close()
+            writer.queue_keybox(channel_id, message_id, hash_value, None, False)
             
             logger.info(f"Found invalid keybox in message {message_id} from channel {channel_id}")
             return False
@@ -356,11 +475,113 @@ async def download_file_with_proper_dc_handling(client, message):
         logger.error(f"Error downloading media: {e}")
         return None
 
-async def process_message_media(client, message, channel_id):
+def should_download_media(media):
+    """Check whether message media could hold a keybox before downloading it."""
+    # Photos are re-encoded by Telegram and never carry files
+    if isinstance(media, MessageMediaPhoto):
+        return False
+        
+    document = getattr(media, 'document', None)
+    if document is None:
+        return True
+        
+    if (getattr(document, 'size', 0) or 0) > MAX_DOCUMENT_SIZE:
+        return False
+        
+    # Media files only qualify when they are named like XML or an archive
+    mime_type = getattr(document, 'mime_type', None) or ''
+    if mime_type.startswith(SKIPPED_MIME_PREFIXES):
+        return has_keybox_file_name(media)
+        
+    return True
+
+def has_keybox_file_name(media):
+    """Check whether a media document is named like an XML file or an archive."""
+    document = getattr(media, 'document', None)
+    for attr in getattr(document, 'attributes', None) or []:
+        file_name = getattr(attr, 'file_name', None)
+        if file_name and file_name.lower().endswith(('.xml',) + ARCHIVE_SUFFIXES):
+            return True
+    return False
+
+async def stream_media_content(client, media):
+    """Download media in chunks, returning None once its head shows it cannot hold a keybox."""
+    content = bytearray()
+    sniffed = has_keybox_file_name(media)
+    
+    # Files that will be downloaded in full anyway do not need to arrive in order
+    document = getattr(media, 'document', None)
+    if sniffed and (getattr(document, 'size', 0) or 0) > PARALLEL_DOWNLOAD_MIN_SIZE:
+        return await download_media_parallel(client, media)
+    
+    async for chunk in client.iter_download(media, request_size=MEDIA_CHUNK_SIZE):
+        content += chunk
+        if not sniffed and len(content) >= MEDIA_SNIFF_SIZE:
+            # Archives and XML files show their signature near the start
+            head = bytes(content[:512])
+            if not (is_archive(head) or head.startswith(XML_HEAD) or ATTESTATION_TAG in content):
+                return None
+            sniffed = True
+            
+    return bytes(content)
+
+async def fetch_media_chunks(client, media, offset, stride):
+    """Fetch every chunk of media starting at offset and stepping by stride."""
+    return [chunk async for chunk in client.iter_download(media, offset=offset, stride=stride, request_size=MEDIA_CHUNK_SIZE)]
+
+async def download_media_parallel(client, media):
+    """Download media over several interleaved chunk streams at once."""
+    stride = MEDIA_CHUNK_SIZE * PARALLEL_DOWNLOAD_STREAMS
+    streams = await asyncio.gather(
+        *(fetch_media_chunks(client, media, i * MEDIA_CHUNK_SIZE, stride) for i in range(PARALLEL_DOWNLOAD_STREAMS))
+    )
+    
+    # Stream i holds chunks i, i + N, i + 2N, ...; interleave them back into file order
+    return b''.join(chunk for chunks in itertools.zip_longest(*streams, fillvalue=b'') for chunk in chunks)
+
+def process_media_content(writer, media, media_content, channel_id, message_id):
+    """Look for keyboxes in downloaded media, by file name, archive contents and content."""
+    # Check if it's an XML file by filename
+    if hasattr(media, 'document') and media.document.attributes:
+        for attr in media.document.attributes:
+            if hasattr(attr, 'file_name') and attr.file_name:
+                filename = getattr(attr, 'file_name', '')
+                logger.info(f"Examining file: {filename}")
+                if filename.lower().endswith('.xml'):
+                    # Direct XML file
+                    logger.info(f"XML file detected by filename: {filename}")
+                    process_potential_keybox(writer, media_content, channel_id, message_id)
+                    return
+    
+    # Check if it's an archive
+    archive_type = is_archive(media_content)
+    if archive_type:
+        logger.info(f"Archive detected: {archive_type}")
+        xml_files = extract_xml_from_archive(media_content, archive_type)
+        logger.info(f"Extracted {len(xml_files)} XML files from archive")
+        for file_name, xml_content in xml_files:
+            process_potential_keybox(writer, xml_content, channel_id, message_id)
+        # The raw archive bytes are never a keybox themselves
+        return
+    
+    # Check if it could be an XML file by content (even without proper extension)
+    try:
+        if media_content.startswith(XML_HEAD) or ATTESTATION_TAG in media_content:
+            logger.info("XML content detected by content signature")
+            process_potential_keybox(writer, media_content, channel_id, message_id)
+    except Exception as content_error:
+        logger.error(f"Error examining file content: {content_error}")
+
+async def process_message_media(client, writer, message, channel_id):
     """Process media attachments in a message."""
     if not message.media:
         return
 
+    if not should_download_media(message.media):
+        logger.info(f"Skipping media in message {message.id} from channel {channel_id}")
+        writer.queue_processed(channel_id, message.id, "skipped")
+        return
+
     # Check file size to add delay for large files
     file_size = 0
     if hasattr(message.media, 'document') and hasattr(message.media.document, 'size'):
@@ -371,11 +592,14 @@ async def process_message_media(client, message, channel_id):
 
     try:
         if isinstance(message.media, (MessageMediaDocument, MessageMediaPhoto)):
-            # Simple download without dc_id parameter
+            # Stream the download so files without a keybox signature stop early
             media_content = None
             try:
                 logger.info(f"Starting download for message {message.id} from channel {channel_id}")
-                media_content = await message.download_media(file=bytes)
+                media_content = await stream_media_content(client, message.media)
+                if media_content is None:
+                    logger.info(f"No keybox signature in the first {MEDIA_SNIFF_SIZE} bytes of message {message.id}, download stopped")
+                    return
                 logger.info(f"Download completed successfully, size: {len(media_content) if media_content else 0} bytes")
             except Exception as e:
                 logger.error(f"Download failed, trying fallback: {e}")
@@ -402,86 +626,46 @@ async def process_message_media(client, message, channel_id):
                 logger.warning(f"Could not download media from message {message.id}")
                 return
                 
-            # Check if it's an XML file by filename
-            if hasattr(message.media, 'document') and message.media.document.attributes:
-                for attr in message.media.document.attributes:
-                    if hasattr(attr, 'file_name') and attr.file_name:
-                        filename = getattr(attr, 'file_name', '')
-                        logger.info(f"Examining file: {filename}")
-                        if XML_FILE_PATTERN.match(filename):
-                            # Direct XML file
-                            logger.info(f"XML file detected by filename: {filename}")
-                            process_potential_keybox(media_content, channel_id, message.id)
-                            return
-            
-            # Check if it's an archive
-            archive_type = is_archive(media_content)
-            if archive_type:
-                logger.info(f"Archive detected: {archive_type}")
-                xml_files = extract_xml_from_archive(media_content, archive_type)
-                logger.info(f"Extracted {len(xml_files)} XML files from archive")
-                for file_name, xml_content in xml_files:
-                    process_potential_keybox(xml_content, channel_id, message.id)
-            
-            # Check if it could be an XML file by content (even without proper extension)
-            try:
-                if media_content.startswith(b'<?xml') or b'<AndroidAttestation>' in media_content:
-                    logger.info("XML content detected by content signature")
-                    process_potential_keybox(media_content, channel_id, message.id)
-            except Exception as content_error:
-                logger.error(f"Error examining file content: {content_error}")
+            # Extraction and validation run off the event loop so other downloads keep going
+            await asyncio.to_thread(process_media_content, writer, message.media, media_content, channel_id, message.id)
                 
     except Exception as e:
         logger.error(f"Error processing media for message {message.id}: {e}")
     finally:
         # Mark message as processed even if there were errors
-        try:
-            conn = sqlite3.connect(TELEGRAM_DB)
-            c = conn.cursor()
-            c.execute(
-                'UPDATE messages SET processed = 1, media_path = ? WHERE channel_id = ? AND message_id = ?',
-                ("processed", channel_id, message.id)
-            )
-            conn.commit()
-            conn.close()
-            logger.info(f"Marked message {message.id} as processed")
-        except Exception as db_error:
-            logger.error(f"Error marking message as processed: {db_error}")
+        writer.queue_processed(channel_id, message.id, "processed")
+        logger.info(f"Marked message {message.id} as processed")
+
+async def process_message_media_limited(semaphore, client, writer, message, channel_id):
+    """Process media attachments in a message once a download slot is free."""
+    async with semaphore:
+        await process_message_media(client, writer, message, channel_id)
 
-async def process_message_text(message, channel_id):
+async def process_message_text(writer, message, channel_id):
     """Process text content in a message for potential keybox XML."""
     if not message.text:
         return
         
-    # Look for XML content in the message text
-    if '<?xml' in message.text or '<AndroidAttestation>' in message.text:
+    # Look for XML content in the message text in a single scan
+    xml_start = XML_START_PATTERN.search(message.text)
+    if xml_start:
         try:
-            # Extract XML content from the message text
-            xml_start = message.text.find('<?xml')
-            if xml_start == -1:
-                xml_start = message.text.find('<AndroidAttestation>')
-                
-            if xml_start >= 0:
-                xml_content = message.text[xml_start:].encode('utf-8')
-                process_potential_keybox(xml_content, channel_id, message.id)
+            # Only the XML part of the text needs encoding
+            xml_content = message.text[xml_start.start():].encode('utf-8')
+            process_potential_keybox(writer, xml_content, channel_id, message.id)
         except Exception as e:
             logger.error(f"Error processing text content for message {message.id}: {e}")
     
     # Mark message as processed
-    try:
-        conn = sqlite3.connect(TELEGRAM_DB)
-        c = conn.cursor()
-        c.execute(
-            'UPDATE messages SET processed = 1 WHERE channel_id = ? AND message_id = ?',
-            (channel_id, message.id)
-        )
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"Error marking text message as processed: {e}")
+    writer.queue_processed(channel_id, message.id)
 
 async def scrape_channel(client, channel_id, last_message_id=0):
     """Scrape messages from a channel."""
+    # A writer thread applies every database write made during this scrape
+    writer = DBWriter()
+    # Media downloads run alongside the message loop, a few at a time
+    media_semaphore = asyncio.Semaphore(MEDIA_DOWNLOAD_CONCURRENCY)
+    media_tasks = []
     try:
         # Determine the entity (supports both channel username and numerical ID)
         if channel_id.startswith('-100'):
@@ -489,21 +673,19 @@ async def scrape_channel(client, channel_id, last_message_id=0):
         else:
             entity = channel_id
             
-        # Get channel information
+        # Get channel information, resolving each channel only once per process
         try:
-            channel_entity = await client.get_entity(entity)
-            channel_name = getattr(channel_entity, 'title', channel_id)
-            
-            # Update channel name in database
-            conn = sqlite3.connect(TELEGRAM_DB)
-            c = conn.cursor()
-            c.execute(
-                'UPDATE channels SET channel_name = ? WHERE channel_id = ?',
-                (channel_name, channel_id)
-            )
-            conn.commit()
-            conn.close()
-            
+            if channel_id in entity_cache:
+                entity, channel_name = entity_cache[channel_id]
+            else:
+                channel_entity = await client.get_entity(entity)
+                channel_name = getattr(channel_entity, 'title', channel_id)
+                entity = await client.get_input_entity(channel_entity)
+                entity_cache[channel_id] = (entity, channel_name)
+                
+                # Update channel name in database
+                writer.update_channel_name(channel_id, channel_name)
+                
             logger.info(f"Scraping channel: {channel_name} ({channel_id})")
         except Exception as entity_error:
             logger.error(f"Error getting channel entity: {entity_error}")
@@ -511,20 +693,24 @@ async def scrape_channel(client, channel_id, last_message_id=0):
             
         # Get messages
         message_count = 0
+        max_message_id = last_message_id
         try:
             async for message in client.iter_messages(entity, min_id=last_message_id, limit=200):  # Added limit to avoid processing too many messages at once
                 try:
                     message_count += 1
                     
                     # Save message to database
-                    save_message(channel_id, message)
+                    save_message(writer, channel_id, message)
                     
                     # Process message contents
-                    await process_message_text(message, channel_id)
-                    await process_message_media(client, message, channel_id)
+                    await process_message_text(writer, message, channel_id)
+                    if message.media:
+                        media_tasks.append(asyncio.create_task(
+                            process_message_media_limited(media_semaphore, client, writer, message, channel_id)
+                        ))
                     
-                    # Update last message ID in state
-                    update_channel_last_message(channel_id, message.id)
+                    # Track the newest message seen; messages arrive newest first
+                    max_message_id = max(max_message_id, message.id)
                     
                     if message_count % 50 == 0:
                         logger.info(f"Processed {message_count} messages from {channel_name}")
@@ -535,7 +721,11 @@ async def scrape_channel(client, channel_id, last_message_id=0):
                     continue
         except Exception as iter_error:
             logger.error(f"Error iterating messages: {iter_error}")
-                
+            
+        # Update last message ID in state once per scrape
+        if max_message_id > last_message_id:
+            writer.queue_last_id(channel_id, max_message_id)
+            
         return message_count
         
     except Exception as e:
@@ -545,6 +735,10 @@ async def scrape_channel(client, channel_id, last_message_id=0):
             logger.warning(f"Rate limited. Waiting {wait_time} seconds")
             await asyncio.sleep(wait_time)
         return 0
+    finally:
+        # Let any downloads still in flight finish before the writer stops
+        await asyncio.gather(*media_tasks, return_exceptions=True)
+        writer.close()
 
 async def continuous_scraping():
     """Continuously scrape all channels in the database."""
@@ -746,81 +940,78 @@ async def main():
     # Setup the database tables
     setup_database()
     
-    # Print a menu
-    print("\nTelegram Crawler for KeyBoxer")
-    print("=" * 40)
-    print("1. Add channel")
-    print("2. List tracked channels")
-    print("3. List available channels")
-    print("4. Run one-time scrape")
-    print("5. Start continuous scraping")
-    print("6. View statistics")
-    print("7. Exit")
-    
-    choice = input("\nSelect an option: ")
-    
-    if choice == "1":
-        channel_id = input("Enter channel ID or username: ")
-        add_channel(channel_id)
-        print(f"Channel {channel_id} added")
-        
-    elif choice == "2":
-        channels = get_channels()
-        print("\nTracked channels:")
-        for channel_id, channel_name, last_message_id in channels:
-            print(f"- {channel_name or 'Unknown'} ({channel_id}) - Last message: {last_message_id}")
-            
-    elif choice == "3":
-        await list_available_channels()
+    while True:
+        # Print a menu
+        print("\nTelegram Crawler for KeyBoxer")
+        print("=" * 40)
+        print("1. Add channel")
+        print("2. List tracked channels")
+        print("3. List available channels")
+        print("4. Run one-time scrape")
+        print("5. Start continuous scraping")
+        print("6. View statistics")
+        print("7. Exit")
         
-    elif choice == "4":
-        print("Starting one-time scrape...")
-        await one_time_scrape()
+        choice = input("\nSelect an option: ")
         
-    elif choice == "5":
-        print("Starting continuous scraping. Press Ctrl+C to stop.")
-        try:
-            await continuous_scraping()
-        except KeyboardInterrupt:
-            print("\nStopping continuous scraping...")
+        if choice == "1":
+            channel_id = input("Enter channel ID or username: ")
+            add_channel(channel_id)
+            print(f"Channel {channel_id} added")
             
-    elif choice == "6":
-        # View statistics
-        conn = sqlite3.connect(TELEGRAM_DB)
-        c = conn.cursor()
-        
-        c.execute('SELECT COUNT(*) FROM messages')
-        message_count = c.fetchone()[0]
-        
-        c.execute('SELECT COUNT(*) FROM messages WHERE keybox_found = 1')
-        keyboxes_found = c.fetchone()[0]
-        
-        c.execute('SELECT COUNT(*) FROM keyboxes WHERE valid = 1')
-        valid_keyboxes = c.fetchone()[0]
-        
-        c.execute('SELECT channel_name, COUNT(*) as msg_count FROM messages JOIN channels ON messages.channel_id = channels.channel_id GROUP BY messages.channel_id ORDER BY msg_count DESC')
-        channel_stats = c.fetchall()
-        
-        conn.close()
-        
-        print("\nStatistics:")
-        print(f"Total messages processed: {message_count}")
-        print(f"Keyboxes found: {keyboxes_found}")
-        print(f"Valid keyboxes: {valid_keyboxes}")
-        
-        print("\nMessages per channel:")
-        for channel_name, count in channel_stats:
-            print(f"- {channel_name or 'Unknown'}: {count} messages")
+        elif choice == "2":
+            channels = get_channels()
+            print("\nTracked channels:")
+            for channel_id, channel_name, last_message_id in channels:
+                print(f"- {channel_name or 'Unknown'} ({channel_id}) - Last message: {last_message_id}")
+                
+        elif choice == "3":
+            await list_available_channels()
             
-    elif choice == "7":
-        print("Exiting...")
-        return
-        
-    else:
-        print("Invalid choice")
-    
-    # Run main again for menu loop
-    await main()
+        elif choice == "4":
+            print("Starting one-time scrape...")
+            await one_time_scrape()
+            
+        elif choice == "5":
+            print("Starting continuous scraping. Press Ctrl+C to stop.")
+            try:
+                await continuous_scraping()
+            except KeyboardInterrupt:
+                print("\nStopping continuous scraping...")
+                
+        elif choice == "6":
+            # View statistics
+            conn = sqlite3.connect(TELEGRAM_DB)
+            c = conn.cursor()
+            
+            c.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM messages),
+                (SELECT COUNT(*) FROM messages WHERE keybox_found = 1),
+                (SELECT COUNT(*) FROM keyboxes WHERE valid = 1)
+            ''')
+            message_count, keyboxes_found, valid_keyboxes = c.fetchone()
+            
+            c.execute('SELECT channel_name, COUNT(*) as msg_count FROM messages JOIN channels ON messages.channel_id = channels.channel_id GROUP BY messages.channel_id ORDER BY msg_count DESC')
+            channel_stats = c.fetchall()
+            
+            conn.close()
+            
+            print("\nStatistics:")
+            print(f"Total messages processed: {message_count}")
+            print(f"Keyboxes found: {keyboxes_found}")
+            print(f"Valid keyboxes: {valid_keyboxes}")
+            
+            print("\nMessages per channel:")
+            for channel_name, count in channel_stats:
+                print(f"- {channel_name or 'Unknown'}: {count} messages")
+                
+        elif choice == "7":
+            print("Exiting...")
+            return
+            
+        else:
+            print("Invalid choice")
 
 if __name__ == "__main__":
     try:
@@ -18,15 +18,23 @@ from dotenv import load_dotenv
 from telethon import TelegramClient
 from telethon.tl.functions.channels import JoinChannelRequest
 from telethon.tl.functions.messages import ImportChatInviteRequest, CheckChatInviteRequest
-from telethon.tl.types import InputMessagesFilterUrl, InputPeerEmpty, MessageMediaDocument, MessageMediaPhoto
+from telethon.tl.types import InputMessagesFilterUrl, InputPeerEmpty
 from telethon.errors import (
     ChatAdminRequiredError, 
     ChannelPrivateError, 
     InviteHashInvalidError, 
-    FloodWaitError
+    FloodWaitError,
+    UsernameNotOccupiedError,
+    UsernameInvalidError
 )
 from telethon.sessions import StringSession
 
+# google-re2 matches in linear time; the standard library is used when it is not installed
+try:
+    import re2
+except ImportError:
+    re2 = None
+
 # Load environment variables
 load_dotenv()
 TELEGRAM_API_ID = os.getenv("TELEGRAM_API_ID")
@@ -38,6 +46,7 @@ TELEGRAM_SESSION_STRING = os.getenv("TELEGRAM_SESSION_STRING")
 BASE_DIR = Path(__file__).resolve().parent
 TELEGRAM_SESSION_DIR = BASE_DIR / "telegram_session"
 TELEGRAM_DB = BASE_DIR / "telegram_data.db"
+TELEGRAM_DB_STR = str(TELEGRAM_DB)
 
 # Configure logging
 logging.basicConfig(
@@ -52,19 +61,55 @@ logger = logging.getLogger("telegram_discovery")
 
 # Patterns and search terms - mirrored from keyboxer.py
 SEARCH_TERM = "<AndroidAttestation>"
-INVITE_LINK_PATTERN = re.compile(r't\.me/[+]([\w-]+)')
-CHANNEL_LINK_PATTERN = re.compile(r't\.me/([\w_]+)')
-XML_FILE_PATTERN = re.compile(r'.*\.xml$', re.IGNORECASE)
+# t.me links in one pass: group 1 is an invite hash, group 2 a channel username.
+# Both are ASCII-only, so explicit classes stand in for re.ASCII, which re2 does not take.
+LINK_PATTERN = (re2 or re).compile(r't\.me/(?:\+([A-Za-z0-9_-]+)|([A-Za-z0-9_]+))')
 SUPPORTED_EXTENSIONS = ['.xml', '.zip', '.gz', '.tar', '.tgz', '.tar.gz']
 
 # Default timeout in seconds (30 minutes)
 DEFAULT_TIMEOUT = 30 * 60
 
+# Entity lookups allowed in flight at once, and the pause each one takes first
+ENTITY_LOOKUP_CONCURRENCY = 5
+ENTITY_LOOKUP_DELAY = 0.2
+
+# Dialogs scanned for links at once
+DIALOG_SCAN_CONCURRENCY = 5
+
+# Lookup errors that will not change on a retry; get_entity raises ValueError
+# for a username that no one has
+PERMANENT_LOOKUP_ERRORS = (ValueError, UsernameNotOccupiedError, UsernameInvalidError)
+
+# Statements run with executemany; sqlite3 caches the prepared form by SQL text
+INSERT_DISCOVERED_CHANNEL_SQL = (
+    'INSERT OR IGNORE INTO discovered_channels (channel_id, channel_name, source) VALUES (?, ?, ?)'
+)
+UPDATE_LINK_SCAN_SQL = (
+    'INSERT INTO link_scan_state (channel_id, last_message_id) VALUES (?, ?) '
+    'ON CONFLICT(channel_id) DO UPDATE SET last_message_id = excluded.last_message_id'
+)
+UPDATE_JOIN_STATUS_SQL = (
+    'INSERT INTO discovered_channels (channel_id, channel_name, join_status) VALUES (?, ?, ?) '
+    'ON CONFLICT(channel_id) DO UPDATE SET join_status = excluded.join_status'
+)
+
+def open_database():
+    """Open a connection to the database with the per-connection PRAGMAs applied."""
+    conn = sqlite3.connect(TELEGRAM_DB_STR)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA cache_size=-20000')
+    return conn
+
 def setup_database():
-    """Setup the SQLite database for storing telegram discovery data."""
-    conn = sqlite3.connect(str(TELEGRAM_DB))
+    """Setup the SQLite database for storing telegram discovery data and return the connection."""
+    conn = open_database()
     c = conn.cursor()
     
+    # WAL mode is stored in the database file, so every later connection uses it
+    c.execute('PRAGMA journal_mode=WAL')
+    
     # Create discovered_channels table
     c.execute('''
     CREATE TABLE IF NOT EXISTS discovered_channels (
@@ -77,6 +122,9 @@ def setup_database():
     )
     ''')
     
+    # The pending-channels query filters on join_status; channel_id is already indexed by UNIQUE
+    c.execute('CREATE INDEX IF NOT EXISTS idx_discovered_channels_join_status ON discovered_channels(join_status)')
+    
     # Create channels table if it doesn't exist with consistent schema
     c.execute('''
     CREATE TABLE IF NOT EXISTS channels (
@@ -87,65 +135,104 @@ def setup_database():
     )
     ''')
     
+    # Newest message already scanned for links in each dialog, so later runs only fetch new ones
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS link_scan_state (
+        channel_id TEXT PRIMARY KEY,
+        last_message_id INTEGER DEFAULT 0
+    )
+    ''')
+    
     conn.commit()
-    conn.close()
+    return conn
+
+def add_discovered_channels_bulk(conn, rows):
+    """Add newly discovered channels to the database in one transaction.
 
-def add_discovered_channel(channel_id, channel_name, source):
-    """Add a newly discovered channel to the database."""
-    conn = sqlite3.connect(str(TELEGRAM_DB))
+    rows is a list of (channel_id, channel_name, source) tuples. Returns the
+    number of channels that were not already known.
+    """
+    if not rows:
+        return 0
+        
     c = conn.cursor()
     
     try:
-        c.execute(
-            'INSERT OR IGNORE INTO discovered_channels (channel_id, channel_name, source) VALUES (?, ?, ?)',
-            (str(channel_id), channel_name, source)
-        )
+        c.executemany(INSERT_DISCOVERED_CHANNEL_SQL, rows)
         conn.commit()
-        if c.rowcount > 0:
-            logger.info(f"Added discovered channel {channel_name} ({channel_id}) from {source}")
-            return True
-        return False
+        return c.rowcount
     except sqlite3.Error as e:
-        logger.error(f"Database error adding discovered channel: {e}")
+        logger.error(f"Database error adding discovered channels: {e}")
+        return 0
+
+def queue_discovered_channel(rows, known_channel_ids, channel_id, channel_name, source):
+    """Queue a channel for insertion unless it is already known. Returns True if queued."""
+    channel_id = str(channel_id)
+    if channel_id in known_channel_ids:
         return False
-    finally:
-        conn.close()
+    known_channel_ids.add(channel_id)
+    rows.append((channel_id, channel_name, source))
+    return True
+
+async def get_entity_limited(client, semaphore, target):
+    """Resolve an entity while holding one of the lookup slots."""
+    async with semaphore:
+        await asyncio.sleep(ENTITY_LOOKUP_DELAY)
+        return await client.get_entity(target)
 
-async def process_message_media(client, message, channel_id):
-    """Process media attachments in a message for potential keybox files."""
-    if not message.media:
+async def scan_dialog_links(client, semaphore, dialog, last_scanned_id, start_time):
+    """Collect channel usernames linked from a dialog's keyword messages. Returns (usernames, newest message id)."""
+    channel_usernames = set()
+    max_scanned_id = last_scanned_id
+    
+    async with semaphore:
+        # First check if this dialog contains our keyword
+        has_keyword = False
+        async for _ in client.iter_messages(dialog.id, search=SEARCH_TERM, limit=1):
+            has_keyword = True
+            break
+        
+        if not has_keyword:
+            return channel_usernames, max_scanned_id
+            
+        async for message in client.iter_messages(dialog.id, search=SEARCH_TERM, min_id=last_scanned_id, limit=30):
+            max_scanned_id = max(max_scanned_id, message.id)
+            # Skip the regex entirely for messages without a t.me link
+            if message.text and 't.me/' in message.text:
+                # Extract links from keyword-containing messages
+                for match in LINK_PATTERN.finditer(message.text):
+                    if match.group(2):
+                        channel_usernames.add(match.group(2))
+            
+            # Check time elapsed to avoid timeouts
+            elapsed = time.time() - start_time
+            if elapsed > (DEFAULT_TIMEOUT * 0.8):  # If we've used 80% of timeout
+                logger.warning(f"Approaching timeout, skipping remaining message checks")
+                break
+    
+    return channel_usernames, max_scanned_id
+
+def update_link_scan_state(conn, rows):
+    """Record the newest scanned message per dialog as (channel_id, last_message_id) tuples."""
+    if not rows:
         return
+        
+    try:
+        conn.executemany(UPDATE_LINK_SCAN_SQL, rows)
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error updating link scan state: {e}")
 
+def update_join_statuses(conn, updates):
+    """Record join results as (channel_id, channel_name, join_status) tuples in one transaction."""
+    if not updates:
+        return
+        
     try:
-        if isinstance(message.media, (MessageMediaDocument, MessageMediaPhoto)):
-            # Simple download without dc_id parameter
-            try:
-                media_content = await message.download_media(file=bytes)
-            except Exception as e:
-                logger.error(f"Download failed, trying fallback: {e}")
-                try:
-                    # Fallback to client download
-                    media_content = await client.download_media(message, bytes)
-                except Exception as e2:
-                    logger.error(f"All download attempts failed: {e2}")
-                    media_content = None
-            
-            if not media_content:
-                return
-                
-            # Check if file has XML in filename
-            if hasattr(message.media, 'document') and message.media.document.attributes:
-                for attr in message.media.document.attributes:
-                    if hasattr(attr, 'file_name') and attr.file_name:
-                        if XML_FILE_PATTERN.match(attr.file_name):
-                            logger.info(f"Found XML file: {attr.file_name}")
-                            
-            # Look for XML content
-            if media_content and (media_content.startswith(b'<?xml') or b'<AndroidAttestation>' in media_content):
-                logger.info(f"Found potential keybox XML content in message {message.id}")
-                
-    except Exception as e:
-        logger.error(f"Error processing media: {e}")
+        conn.executemany(UPDATE_JOIN_STATUS_SQL, updates)
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Database error updating join status: {e}")
 
 async def run_discovery_with_timeout(timeout=DEFAULT_TIMEOUT, leave_after_completion=True):
     """Run discovery with a timeout."""
@@ -181,9 +268,6 @@ async def run_discovery_with_timeout(timeout=DEFAULT_TIMEOUT, leave_after_comple
 
 async def run_discovery(leave_after_completion=True):
     """Main Telegram channel discovery process with enhanced capabilities."""
-    # Ensure database is set up
-    setup_database()
-    
     if not TELEGRAM_API_ID or not TELEGRAM_API_HASH:
         logger.error("Telegram API credentials not found. Set TELEGRAM_API_ID and TELEGRAM_API_HASH in .env file.")
         return False
@@ -199,17 +283,41 @@ async def run_discovery(leave_after_completion=True):
         logger.error("No Telegram session string found. Cannot proceed.")
         return False
     
+    # Joined channels are handed to the crawler's tracking list. The crawler is
+    # imported on the first successful join only: importing it also imports
+    # check.py, which fetches the attestation status list and may fail.
+    add_channel = None
+    add_channel_loaded = False
+    
+    # Ensure database is set up; the same connection serves every query of the run
+    conn = setup_database()
+    # Rows still to be written; whatever a timeout leaves here is written in the
+    # finally block, so channels found before the cancellation are kept
+    dialog_rows = []
+    global_rows = []
+    link_rows = []
+    join_updates = []
+    
     try:
         logger.info("Starting Telegram client")
         await client.start()
         
         # Record start time to monitor progress
         start_time = time.time()
-        discovered_count = 0
+        
+        # Throttles the entity lookups of step 3
+        lookup_semaphore = asyncio.Semaphore(ENTITY_LOOKUP_CONCURRENCY)
+        # Entities seen during discovery by channel id, so the join step can skip the lookup
+        entity_cache = {}
+        
+        # Channels already in the database are skipped before any insert is attempted
+        known_channel_ids = {row[0] for row in conn.execute('SELECT channel_id FROM discovered_channels')}
         
         # Step 1: MODIFIED - Only process existing dialogs that contain the keyword
         logger.info("Searching existing dialogs for channels with keyword...")
-        async for dialog in client.iter_dialogs(limit=100):
+        # Fetch the dialog list once; step 3 reuses the first few entries
+        dialogs = [dialog async for dialog in client.iter_dialogs(limit=100)]
+        for dialog in dialogs:
             if dialog.is_channel:
                 # Check if channel contains the keyword before adding
                 try:
@@ -223,44 +331,42 @@ async def run_discovery(leave_after_completion=True):
                     if found_keyword:
                         channel_id = dialog.id
                         channel_name = dialog.name or str(channel_id)
-                        if add_discovered_channel(channel_id, channel_name, "dialog_search_with_keyword"):
-                            discovered_count += 1
+                        if queue_discovered_channel(dialog_rows, known_channel_ids, channel_id, channel_name, "dialog_search_with_keyword"):
                             logger.info(f"Found existing channel with keyword: {channel_name}")
                 except Exception as e:
                     logger.debug(f"Error searching dialog {dialog.id}: {e}")
         
+        # Each batch is a single small transaction, so writes run inline on the
+        # event loop; a worker thread could outlive a cancelled run and still be
+        # using the connection when the finally block closes it
+        discovered_count = add_discovered_channels_bulk(conn, dialog_rows)
+        dialog_rows.clear()
         logger.info(f"Discovered {discovered_count} channels with keyword from dialogs")
         logger.info(f"Time elapsed: {time.time() - start_time:.2f} seconds")
         
         # Step 2: Search for relevant channels using the keyword
         logger.info(f"Searching globally using term: {SEARCH_TERM}")
-        global_discovered = 0
 
         try:
             # This step is already optimized as it uses the SEARCH_TERM
             message_count = 0
             async for result in client.iter_messages(None, search=SEARCH_TERM, limit=50):
                 message_count += 1
-                if result.chat:
-                    try:
-                        chat = await client.get_entity(result.chat_id)
-                        if hasattr(chat, 'id') and hasattr(chat, 'title'):
-                            channel_id = str(chat.id)
-                            channel_name = chat.title
-                            
-                            # Add to discovered channels
-                            if add_discovered_channel(channel_id, channel_name, f"global_search:{SEARCH_TERM}"):
-                                global_discovered += 1
-                                logger.info(f"Found channel from search: {channel_name} ({channel_id})")
-                    except Exception as chat_error:
-                        logger.debug(f"Error getting chat entity: {chat_error}")
+                # The search response already carries each result's chat, so no lookup is needed
+                chat = result.chat
+                if chat and hasattr(chat, 'id') and hasattr(chat, 'title'):
+                    channel_id = str(chat.id)
+                    channel_name = chat.title
+                    entity_cache[channel_id] = chat
+                    
+                    # Add to discovered channels
+                    if queue_discovered_channel(global_rows, known_channel_ids, channel_id, channel_name, f"global_search:{SEARCH_TERM}"):
+                        logger.info(f"Found channel from search: {channel_name} ({channel_id})")
                 
                 # Check if we're approaching timeout
                 if message_count % 10 == 0:
                     elapsed = time.time() - start_time
                     logger.info(f"Processed {message_count} search results. Time elapsed: {elapsed:.2f} seconds")
-            
-            logger.info(f"Discovered {global_discovered} additional channels from global search")
         except Exception as e:
             logger.error(f"Error in global search for '{SEARCH_TERM}': {e}")
             if isinstance(e, FloodWaitError):
@@ -268,54 +374,68 @@ async def run_discovery(leave_after_completion=True):
                 logger.warning(f"Rate limited. Waiting {wait_time} seconds")
                 await asyncio.sleep(wait_time)
         
+        global_discovered = add_discovered_channels_bulk(conn, global_rows)
+        global_rows.clear()
+        logger.info(f"Discovered {global_discovered} additional channels from global search")
         logger.info(f"Time elapsed after search: {time.time() - start_time:.2f} seconds")
         
         # Step 3: MODIFIED - Focus channel link extraction on relevant messages
         logger.info("Looking for channel links in messages containing keywords...")
-        link_discovered = 0
+        link_scan_ids = dict(conn.execute('SELECT channel_id, last_message_id FROM link_scan_state'))
+        link_scan_updates = []
+        # Newest scanned message per dialog; a dialog is only recorded once all its links resolved
+        scanned_ids = {}
+        # Lowercased username -> (username as linked, ids of the dialogs linking it)
+        linked_usernames = {}
         
         try:
-            # Limit to dialogs with the keyword
-            dialog_count = 0
-            async for dialog in client.iter_dialogs(limit=10):
-                dialog_count += 1
-                if dialog.is_channel:
-                    # First check if this dialog contains our keyword
-                    has_keyword = False
-                    async for _ in client.iter_messages(dialog.id, search=SEARCH_TERM, limit=1):
-                        has_keyword = True
-                        break
+            # Scan the first few channel dialogs concurrently; each scan holds one slot
+            link_dialogs = [dialog for dialog in dialogs[:10] if dialog.is_channel]
+            scan_semaphore = asyncio.Semaphore(DIALOG_SCAN_CONCURRENCY)
+            scans = await asyncio.gather(
+                *(scan_dialog_links(client, scan_semaphore, dialog, link_scan_ids.get(str(dialog.id), 0), start_time) for dialog in link_dialogs),
+                return_exceptions=True
+            )
+            
+            for dialog, scan in zip(link_dialogs, scans):
+                if isinstance(scan, Exception):
+                    logger.debug(f"Error scanning dialog {dialog.id} for links: {scan}")
+                    continue
                     
-                    if has_keyword:
-                        # Only process channels that have the keyword
-                        async for message in client.iter_messages(dialog.id, search=SEARCH_TERM, limit=30):
-                            if message.text:
-                                # Extract links from keyword-containing messages
-                                for match in CHANNEL_LINK_PATTERN.finditer(message.text):
-                                    channel_username = match.group(1)
-                                    try:
-                                        channel = await client.get_entity(channel_username)
-                                        if hasattr(channel, 'id') and hasattr(channel, 'title'):
-                                            if add_discovered_channel(str(channel.id), channel.title, "relevant_message_link"):
-                                                link_discovered += 1
-                                                logger.info(f"Found channel from keyword-relevant link: {channel.title}")
-                                    except Exception as e:
-                                        logger.debug(f"Could not resolve link: {e}")
-                            
-                            # Check time elapsed to avoid timeouts
-                            elapsed = time.time() - start_time
-                            if elapsed > (DEFAULT_TIMEOUT * 0.8):  # If we've used 80% of timeout
-                                logger.warning(f"Approaching timeout, skipping remaining message checks")
-                                break
-                
-                # Check if we're approaching timeout
-                elapsed = time.time() - start_time
-                if elapsed > (DEFAULT_TIMEOUT * 0.8):  # If we've used 80% of timeout
-                    logger.warning(f"Approaching timeout, skipping remaining dialogs")
-                    break
+                dialog_usernames, max_scanned_id = scan
+                if max_scanned_id > link_scan_ids.get(str(dialog.id), 0):
+                    scanned_ids[str(dialog.id)] = max_scanned_id
+                    
+                # Usernames are case-insensitive; each one is resolved at most once per run
+                for channel_username in dialog_usernames:
+                    linked_usernames.setdefault(channel_username.lower(), (channel_username, set()))[1].add(str(dialog.id))
+            
+            # Resolve every linked channel of the scanned dialogs at once
+            linked = list(linked_usernames.values())
+            channels = await asyncio.gather(
+                *(get_entity_limited(client, lookup_semaphore, channel_username) for channel_username, _ in linked),
+                return_exceptions=True
+            )
+            for (channel_username, dialog_ids), channel in zip(linked, channels):
+                if isinstance(channel, PERMANENT_LOOKUP_ERRORS):
+                    logger.debug(f"Could not resolve link {channel_username}: {channel}")
+                elif isinstance(channel, Exception):
+                    # Rescan the linking dialogs next run so the link is not lost
+                    logger.warning(f"Could not resolve link {channel_username}, will retry next run: {channel}")
+                    for dialog_id in dialog_ids:
+                        scanned_ids.pop(dialog_id, None)
+                elif hasattr(channel, 'id') and hasattr(channel, 'title'):
+                    entity_cache[str(channel.id)] = channel
+                    if queue_discovered_channel(link_rows, known_channel_ids, channel.id, channel.title, "relevant_message_link"):
+                        logger.info(f"Found channel from keyword-relevant link: {channel.title}")
+            
+            link_scan_updates.extend(scanned_ids.items())
         except Exception as e:
             logger.error(f"Error searching for links in messages: {e}")
         
+        link_discovered = add_discovered_channels_bulk(conn, link_rows)
+        link_rows.clear()
+        update_link_scan_state(conn, link_scan_updates)
         logger.info(f"Discovered {link_discovered} channels from keyword-relevant links")
         logger.info(f"Time elapsed: {time.time() - start_time:.2f} seconds")
         
@@ -325,12 +445,10 @@ async def run_discovery(leave_after_completion=True):
         
         try:
             # Get channels that are in 'pending' state
-            conn = sqlite3.connect(str(TELEGRAM_DB))
             c = conn.cursor()
             c.execute('SELECT channel_id, channel_name FROM discovered_channels WHERE join_status = "pending" LIMIT ?', 
                      (max_joins,))
             pending_channels = c.fetchall()
-            conn.close()
             
             if pending_channels:
                 logger.info(f"Attempting to join {len(pending_channels)} new channels...")
@@ -343,16 +461,16 @@ async def run_discovery(leave_after_completion=True):
                         break
                         
                     try:
-                        # Try to join the channel
-                        entity = None
+                        # Try to join the channel, reusing the entity if discovery already resolved it
+                        entity = entity_cache.get(channel_id)
                         
                         # Check if it's a numeric ID or username
-                        if channel_id.startswith('-100'):
+                        if entity is None and channel_id.startswith('-100'):
                             try:
                                 entity = await client.get_entity(int(channel_id))
                             except:
                                 pass
-                        else:
+                        elif entity is None:
                             try:
                                 entity = await client.get_entity(channel_id)
                             except:
@@ -367,24 +485,21 @@ async def run_discovery(leave_after_completion=True):
                             result = await client(JoinChannelRequest(entity))
                             
                             # Update status in database
-                            conn = sqlite3.connect(str(TELEGRAM_DB))
-                            c = conn.cursor()
-                            c.execute(
-                                'UPDATE discovered_channels SET join_status = "joined" WHERE channel_id = ?',
-                                (channel_id,)
-                            )
-                            conn.commit()
-                            conn.close()
+                            join_updates.append((channel_id, channel_name, "joined"))
                             
                             join_count += 1
                             logger.info(f"Successfully joined channel: {channel_name}")
                             
                             # Also add to tracking list for crawler
-                            try:
-                                from telegram_crawler import add_channel
+                            if not add_channel_loaded:
+                                add_channel_loaded = True
+                                try:
+                                    from telegram_crawler import add_channel
+                                except Exception as e:
+                                    logger.warning(f"Could not import add_channel from telegram_crawler: {e}")
+                                    add_channel = None
+                            if add_channel:
                                 add_channel(channel_id, channel_name)
-                            except ImportError:
-                                logger.warning("Could not import add_channel from telegram_crawler")
                             
                             # Sleep to avoid rate limiting, but not too long
                             await asyncio.sleep(1)
@@ -392,14 +507,7 @@ async def run_discovery(leave_after_completion=True):
                         logger.error(f"Error joining channel {channel_id}: {e}")
                         
                         # Update status in database to reflect failure
-                        conn = sqlite3.connect(str(TELEGRAM_DB))
-                        c = conn.cursor()
-                        c.execute(
-                            'UPDATE discovered_channels SET join_status = "failed" WHERE channel_id = ?',
-                            (channel_id,)
-                        )
-                        conn.commit()
-                        conn.close()
+                        join_updates.append((channel_id, channel_name, "failed"))
                         continue
         except Exception as e:
             logger.error(f"Error in channel joining process: {e}")
@@ -421,6 +529,13 @@ async def run_discovery(leave_after_completion=True):
             await client.disconnect()
         
         return False
+    finally:
+        # Rows a cancelled step did not get to write
+        add_discovered_channels_bulk(conn, dialog_rows + global_rows + link_rows)
+        update_join_statuses(conn, join_updates)
+        # Refresh planner statistics for tables that changed during the run
+        conn.execute('PRAGMA optimize')
+        conn.close()
 
 if __name__ == "__main__":
     try: